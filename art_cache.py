@@ -0,0 +1,170 @@
+"""Cache of album cover images keyed by URL.
+
+Every track on an album has the same cover, so rather than downloading it
+again for each track the image bytes are kept in a small in-memory LRU and
+in an on-disk LRU under ART_CACHE_DIR. Both are bounded by total size in
+bytes, evicting the least recently used covers first. The directory name
+starts with a dot so library scans skip it.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+ART_CACHE_DIR = '.art_cache'
+
+# Size limits in bytes
+MEMORY_LIMIT = 64 * 1024 * 1024
+DISK_LIMIT = 512 * 1024 * 1024
+
+
+def _key(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+class ArtCache:
+    """Two level LRU of url -> image bytes.
+
+    get() fetches a cover at most once even when several threads ask for it
+    at the same time; the others wait for the first fetch to finish.
+    get_future() can also run the fetch on an executor, which is used to
+    download covers while the audio for their tracks is still downloading.
+    """
+
+    def __init__(self, path=ART_CACHE_DIR, memory_limit=MEMORY_LIMIT, disk_limit=DISK_LIMIT):
+        self.path = path
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()  # url -> bytes
+        self.memory_size = 0
+        self.disk = OrderedDict()  # key -> size, least recently used first
+        self.disk_size = 0
+        self.pending = {}  # url -> Future for fetches in progress
+        self._load_disk()
+
+    def _load_disk(self):
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return
+        entries = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self.disk[name] = size
+            self.disk_size += size
+
+    def _remember(self, url, data):
+        """Add to the memory LRU. Must be called with the lock held."""
+        if len(data) > self.memory_limit:
+            return
+        old = self.memory.pop(url, None)
+        if old is not None:
+            self.memory_size -= len(old)
+        self.memory[url] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_limit:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    def _read_disk(self, url):
+        key = _key(url)
+        with self.lock:
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+        file_path = os.path.join(self.path, key)
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            os.utime(file_path)
+        except OSError:
+            with self.lock:
+                self.disk_size -= self.disk.pop(key, 0)
+            return None
+        return data
+
+    def _write_disk(self, url, data):
+        if len(data) > self.disk_limit:
+            return
+        key = _key(url)
+        file_path = os.path.join(self.path, key)
+        temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, file_path)
+        except OSError:
+            return
+        evicted = []
+        with self.lock:
+            self.disk_size -= self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            self.disk_size += len(data)
+            while self.disk_size > self.disk_limit:
+                old_key, size = self.disk.popitem(last=False)
+                self.disk_size -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(os.path.join(self.path, old_key))
+            except OSError:
+                pass
+
+    def get(self, url, fetch):
+        """Return the image at url, calling fetch(url) to download it if needed.
+
+        fetch should return the image bytes or None. Failures are not cached.
+        """
+        return self.get_future(url, fetch).result()
+
+    def get_future(self, url, fetch, executor=None):
+        """Like get() but returns a Future instead of waiting for the image.
+
+        With an executor the image is loaded in the background, otherwise it
+        is loaded before returning.
+        """
+        with self.lock:
+            data = self.memory.get(url)
+            if data is not None:
+                self.memory.move_to_end(url)
+                future = Future()
+                future.set_result(data)
+                return future
+            future = self.pending.get(url)
+            if future is not None:
+                return future
+            future = self.pending[url] = Future()
+
+        if executor is None:
+            self._load(url, fetch, future)
+        else:
+            executor.submit(self._load, url, fetch, future)
+        return future
+
+    def _load(self, url, fetch, future):
+        data = None
+        try:
+            data = self._read_disk(url)
+            if data is None:
+                data = fetch(url)
+                if data:
+                    self._write_disk(url, data)
+        except BaseException as e:
+            with self.lock:
+                del self.pending[url]
+            future.set_exception(e)
+            return
+        with self.lock:
+            if data:
+                self._remember(url, data)
+            del self.pending[url]
+        future.set_result(data or None)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Library Scan Benchmark
+Builds a synthetic library of tagged mp3 files and times a full index rescan
+with eyed3, with the fast TPUB reader, and with the threaded LibraryIndex.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+from library_index import LibraryIndex, read_publisher
+from downloader_functions import getUri
+
+
+def syncsafe(n):
+    """Encode n as a 4 byte ID3v2 syncsafe integer"""
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f])
+
+
+def text_frame(frame_id, text):
+    """Build an ID3v2.3 text frame with UTF-8 encoding"""
+    data = b'\x03' + text.encode('utf-8')
+    return frame_id + len(data).to_bytes(4, 'big') + b'\x00\x00' + data
+
+
+def make_mp3(path, index, audio_size, art_size):
+    """Write a file with an ID3v2.3 tag like the ones the downloader writes"""
+    frames = b''.join([
+        text_frame(b'TIT2', f"Track {index}"),
+        text_frame(b'TPE1', f"Artist {index % 50}"),
+        text_frame(b'TALB', f"Album {index % 200}"),
+    ])
+    if art_size:
+        art = b'\x00image/jpeg\x00\x03\x00' + os.urandom(art_size)
+        frames += b'APIC' + len(art).to_bytes(4, 'big') + b'\x00\x00' + art
+    frames += text_frame(b'TPUB', f"spotify:track:{index:022d}")
+    frames += b'\x00' * 256  # padding
+    header = b'ID3\x03\x00\x00' + syncsafe(len(frames))
+    # MPEG frame sync followed by filler stands in for the audio data
+    audio = b'\xff\xfb\x90\x64' + b'\x00' * (audio_size - 4)
+    with open(path, 'wb') as f:
+        f.write(header + frames + audio)
+
+
+def build_library(root, count, audio_size, art_size):
+    for i in range(count):
+        folder = os.path.join(root, f"Playlist {i % 10}", f"Artist {i % 50}")
+        os.makedirs(folder, exist_ok=True)
+        make_mp3(os.path.join(folder, f"Track {i}.mp3"), i, audio_size, art_size)
+        if i % 25 == 0:
+            # Non-audio files are skipped by extension
+            with open(os.path.join(folder, f"cover {i}.jpg"), 'wb') as f:
+                f.write(os.urandom(1024))
+
+
+def all_files(root):
+    for dirpath, _, files in os.walk(root):
+        for file in files:
+            yield os.path.join(dirpath, file)
+
+
+def time_it(name, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a full library rescan")
+    parser.add_argument('--files', type=int, default=2000, help="Number of mp3 files to generate")
+    parser.add_argument('--audio-kb', type=int, default=64, help="Size of the fake audio data per file")
+    parser.add_argument('--art-kb', type=int, default=64, help="Size of the embedded cover per file")
+    parser.add_argument('--workers', type=int, default=None, help="Threads for the indexed scan")
+    parser.add_argument('--skip-eyed3', action='store_true', help="Don't time the eyed3 baseline")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='library_bench_')
+    try:
+        library_root = os.path.join(work_dir, 'library')
+        print(f"Generating {args.files} files in {library_root}...")
+        build_library(library_root, args.files, args.audio_kb * 1024, args.art_kb * 1024)
+        paths = [p for p in all_files(library_root) if p.endswith('.mp3')]
+        print()
+
+        if not args.skip_eyed3:
+            expected = time_it("eyed3 (serial)", lambda: [getUri(p) for p in paths])
+        fast = time_it("read_publisher (serial)", lambda: [read_publisher(p) for p in paths])
+        if not args.skip_eyed3 and fast != expected:
+            print("❌ read_publisher disagrees with eyed3")
+            sys.exit(1)
+
+        for workers in ([args.workers] if args.workers else [1, 4, 16]):
+            index = LibraryIndex(os.path.join(work_dir, f"index_{workers}.db"))
+            time_it(f"LibraryIndex ({workers} workers)",
+                    lambda: index.refresh([library_root], quiet=True, workers=workers))
+            index.close()
+
+        index = LibraryIndex(os.path.join(work_dir, f"index_{workers}.db"))
+        time_it("LibraryIndex (unchanged)", lambda: index.refresh([library_root], quiet=True))
+        found = len(index.uris())
+        index.close()
+        print(f"\n{found}/{len(paths)} URIs indexed")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
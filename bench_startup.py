@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+Measures how long the downloader takes to import its modules using Python's
+-X importtime, and lists the slowest top-level imports.
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Each target is run in a fresh interpreter
+TARGETS = {
+    'downloader_functions': ['-c', 'import downloader_functions'],
+    'library modules': ['-c', 'import downloader_functions, library_index, pipeline'],
+    'playlist_downloader --help': [os.path.join(HERE, 'playlist_downloader.py'), '--help'],
+}
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+def measure(args):
+    """Return (total seconds, [(cumulative us, module)] for top-level imports)"""
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            cwd=HERE, capture_output=True, text=True)
+    imports = []
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, module = int(match.group(2)), match.group(3), match.group(4)
+        # Nested imports are indented by two spaces per level
+        if len(indent) <= 1:
+            imports.append((cumulative, module))
+            total += cumulative
+    if result.returncode != 0 and not imports:
+        print(result.stderr.strip())
+    return total / 1e6, sorted(imports, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark downloader startup imports")
+    parser.add_argument('--top', type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per target, the fastest is reported")
+    args = parser.parse_args()
+
+    for name, target in TARGETS.items():
+        runs = [measure(target) for _ in range(args.runs)]
+        total, imports = min(runs, key=lambda run: run[0])
+        print(f"\n⏱️  {name}: {total * 1000:.0f} ms of imports")
+        for cumulative, module in imports[:args.top]:
+            print(f"   {cumulative / 1000:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
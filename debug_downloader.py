@@ -10,6 +10,9 @@ import pafy
 from tqdm import tqdm
 from spotipy.oauth2 import SpotifyClientCredentials
 from downloader_functions import *
+from library_index import LibraryIndex, library_roots
+from resolution_cache import ResolutionCache
+from pipeline import DEFAULT_WORKERS, WorkerPool, run_pool
 from bs4 import BeautifulSoup
 import time
 
@@ -116,20 +119,15 @@ def debug_song_download(self, quiet=False):
                 raise Exception(f"Both downloads failed: {result.stderr}")
         
         # Find the actual downloaded file (yt-dlp might change the extension)
-        for file in os.listdir(self.folder_name):
-            if file.startswith(self.name_file) and file.endswith('.mp3'):
-                self.file = os.path.join(self.folder_name, file)
-                break
+        downloaded = find_download(self.folder_name, self.name_file)
+        if os.path.exists(final_path):
+            self.file = final_path
+        elif downloaded:
+            # If no mp3 found, rename the file with our name
+            os.rename(downloaded, final_path)
+            self.file = final_path
         else:
-            # If no mp3 found, look for any file with our name and rename it
-            for file in os.listdir(self.folder_name):
-                if file.startswith(self.name_file):
-                    old_path = os.path.join(self.folder_name, file)
-                    os.rename(old_path, final_path)
-                    self.file = final_path
-                    break
-            else:
-                self.file = final_path
+            self.file = final_path
         
         elapsed = time.time() - start_time
         print(f"✅ [{self.name}] YouTube SUCCESS via yt-dlp ({elapsed:.1f}s)")
@@ -179,49 +177,44 @@ except:
 shelveFile.close()
 
 #set variables
-threadList = []  # stores all threads
 downloadQueue = []  # songs to be downloaded
 
 parser = argparse.ArgumentParser(description="Download songs from a Spotify playlist (DEBUG VERSION)")
 parser.add_argument("playlist_url", help="Spotify playlist URL or URI")
 parser.add_argument("--limit", "-l", type=int, help="Only download the first N songs", default=None)
+parser.add_argument("--workers", "-w", type=int, default=DEFAULT_WORKERS,
+                    help=f"Number of songs to download at once (default: {DEFAULT_WORKERS})")
+parser.add_argument("--no-cache", action="store_true",
+                    help="Search every provider again instead of reusing earlier results")
 args = parser.parse_args()
 
 playlist_url = args.playlist_url
 limit = args.limit
 
+# One pooled connection per worker for each host
+configure_http(pool_size=args.workers)
+
+if not args.no_cache:
+    set_resolution_cache(ResolutionCache())
+
 songs, folder_name = getTracks(playlist_url, sp, limit=limit)
 os.makedirs(folder_name, exist_ok=True)
 
 print("Checking already downloaded songs...")
-# get URIs of downloaded songs
-URIs = []
-playlistFolderURIs = []
-for root, _, files in os.walk(folder_name):
-    for file in files:
-        file_path = os.path.join(root, file)
-        if os.path.isfile(file_path):
-            playlistFolderURIs.append(getUri(file_path))
+# get URIs of downloaded songs from the persistent library index
+library = LibraryIndex()
+library.refresh(library_roots(folder_name))
+playlistFolderURIs = library.uris(folder_name)
 
 #Don't download dupe songs from other folders
-URIs.extend(playlistFolderURIs)
-
-for folder in os.listdir():
-    if folder == folder_name or folder.startswith('.'):
-        continue
-    if not os.path.isdir(folder):
-        continue
-    for root, _, files in os.walk(folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if os.path.isfile(file_path):
-                URIs.append(getUri(file_path))
+URIs = library.uris()
 
 for song in songs:
     if song.uri in URIs:
         pass  # Skip already downloaded songs silently
     else:
         downloadQueue.append(song)
+        song.prefetch_art()  # Fetch covers while the audio downloads
 
 print(f"\n🎵 Found {len(songs)} total songs, {len(downloadQueue)} to download")
 print("🔍 DEBUG MODE: Will show which providers are tried for each song\n")
@@ -247,28 +240,22 @@ download_results = {
 }
 
 def thread_download(song):
-    downloadSong(song, quiet=True)
-    progress_bar.update(1)
-
-#While there are songs in download queue download songs
-while len(downloadQueue) > 0:
-    if len(threadList) <= 4:
-        threadObj = threading.Thread(target=thread_download, args=[downloadQueue.pop(0)])
-        threadObj.handled = False
-        threadList.append(threadObj)
-        threadObj.start()
-
-    for t in threadList:
-        if not t.is_alive():
-            t.handled = True
-    threadList = [t for t in threadList if not t.handled]
-
-#Wait for all thread to finish
-for t in threadList:
-    t.join()
+    try:
+        downloadSong(song, quiet=True)
+    finally:
+        progress_bar.update(1)
+
+#Download queued songs with a fixed size worker pool
+pool = WorkerPool(thread_download, workers=args.workers, name='download')
+completed = run_pool(pool, downloadQueue, log=progress_bar.write)
 
 progress_bar.close()
 
+if not completed:
+    library.close()
+    sys.exit(130)
+
 print("Deleting Removed Songs")
-delRemoved(playlistFolderURIs, songs, folder_name)
+delRemoved(playlistFolderURIs, songs, folder_name, library=library)
+library.close()
 print("Done") 
\ No newline at end of file
@@ -1,18 +1,31 @@
-import urllib, os, spotipy, subprocess, eyed3, requests
-from bs4 import BeautifulSoup
-from pytube import YouTube
-from dataclasses import dataclass
-from typing import Optional, Callable, Dict, Any
-
-# Set pafy backend before importing
-import os as os_env
-os_env.environ['PAFY_BACKEND'] = 'internal'
-
-try:
-    import pafy
-except ImportError:
-    pafy = None
-    print("Warning: pafy not available, using yt-dlp only")
+import urllib, os, json, subprocess, requests, threading, hashlib, base64, time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dataclasses import dataclass, field
+from typing import Optional, Callable, Any, Iterator
+from resolution_cache import MISS
+from art_cache import ArtCache
+from tagging import HAVE_MUTAGEN, SongTags, write_tags, read_uri, ffmpeg_metadata_args
+from rate_limit import ProviderLimiter, Throttled
+
+# Modules only needed by some providers (spotipy, bs4, pafy) are imported
+# where they are used so that runs with nothing to download start quickly.
+
+_pafy = None
+
+def _load_pafy():
+    """Return the pafy module, or None if it isn't installed."""
+    global _pafy
+    if _pafy is None:
+        # Set pafy backend before importing
+        os.environ['PAFY_BACKEND'] = 'internal'
+        try:
+            import pafy
+            _pafy = pafy
+        except ImportError:
+            _pafy = False
+            print("Warning: pafy not available, using yt-dlp only")
+    return _pafy or None
 
 
 def sanitize_filename(name: str) -> str:
@@ -28,47 +41,449 @@ def sanitize_filename(name: str) -> str:
 
 
 
-def get_audio_bitrate(file_path):
-    """Return the bitrate of the audio stream in bits per second or None."""
+# Connections kept open per host, see configure_http()
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
+
+# Bytes read per write when downloading files, see download_file()
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Times a dropped download is resumed before giving up
+DOWNLOAD_ATTEMPTS = 5
+# Files at least this large are fetched over several connections at once
+SEGMENT_THRESHOLD = 32 * 1024 * 1024
+DOWNLOAD_SEGMENTS = 4
+
+_http_sessions = {}
+_http_lock = threading.Lock()
+
+class _SessionRetry(Retry):
+    """Retries server errors but hands 429 responses back to the caller.
+
+    Throttling is handled by call_limited(), which backs off and lowers the
+    provider's concurrency; retrying 429s in the session as well would turn
+    each request into several before the limiter heard about any of them.
+    urllib3 retries a 429 carrying Retry-After even when 429 isn't in
+    status_forcelist, hence the subclass.
+    """
+    RETRY_AFTER_STATUS_CODES = frozenset({413, 503})
+
+def configure_http(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                   segments=DOWNLOAD_SEGMENTS):
+    """Set the connection pool size and retry count used for new sessions.
+
+    pool_size should be at least the number of threads that may talk to the
+    same host at once, otherwise connections are discarded instead of reused.
+    chunk_size is the read size used by download_file() and segments the
+    number of connections it uses for large files (1 disables this).
+    """
+    global HTTP_POOL_SIZE, HTTP_RETRIES, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_SEGMENTS
+    with _http_lock:
+        HTTP_POOL_SIZE = pool_size
+        HTTP_RETRIES = retries
+        DOWNLOAD_CHUNK_SIZE = chunk_size
+        DOWNLOAD_SEGMENTS = max(1, segments)
+        for session in _http_sessions.values():
+            session.close()
+        _http_sessions.clear()
+
+def http_session(url):
+    """Return the shared keep-alive session for the host of url."""
+    host = urllib.parse.urlparse(url).netloc
+    with _http_lock:
+        session = _http_sessions.get(host)
+        if session is None:
+            retry = _SessionRetry(total=HTTP_RETRIES, backoff_factor=0.5,
+                                  status_forcelist=[500, 502, 503, 504],
+                                  allowed_methods=['GET', 'HEAD'],
+                                  respect_retry_after_header=True)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_sessions[host] = session
+        return session
+
+def http_get(url, **kwargs):
+    """GET a url through the pooled session for its host."""
+    return http_session(url).get(url, **kwargs)
+
+class DownloadError(Exception):
+    """A download finished but its size or checksum was wrong."""
+
+# Hash algorithms accepted in Digest and x-goog-hash headers
+_DIGEST_ALGORITHMS = {'md5': 'md5', 'sha': 'sha1', 'sha-256': 'sha256', 'sha-512': 'sha512'}
+
+def _expected_digests(response, full_body):
+    """Return {hashlib name: digest bytes} advertised for the whole file.
+
+    Digest and x-goog-hash describe the full file even on a 206 response;
+    Content-MD5 only describes the body sent, so it is used for 200s only.
+    """
+    digests = {}
+    values = []
+    for header in ('Digest', 'x-goog-hash'):
+        if response.headers.get(header):
+            values.extend(response.headers[header].split(','))
+    if full_body and response.headers.get('Content-MD5'):
+        values.append('md5=' + response.headers['Content-MD5'])
+    for value in values:
+        name, _, encoded = value.strip().partition('=')
+        algorithm = _DIGEST_ALGORITHMS.get(name.lower())
+        if algorithm and encoded:
+            try:
+                digests[algorithm] = base64.b64decode(encoded)
+            except ValueError:
+                pass
+    return digests
+
+def _verify_digests(file_path, digests):
+    for algorithm, expected in digests.items():
+        h = hashlib.new(algorithm)
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                h.update(block)
+        if h.digest() != expected:
+            raise DownloadError(f"{algorithm} checksum mismatch for {file_path}")
+
+def _part_source(url, response):
+    """Describe the file a response is sending, so a .part file can be matched to it later"""
+    etag = response.headers.get('ETag')
+    if etag and etag.startswith('W/'):
+        # Weak ETags can't be used with If-Range
+        etag = None
+    return {'url': url, 'etag': etag, 'last_modified': response.headers.get('Last-Modified')}
+
+def _read_part_source(source_path):
+    try:
+        with open(source_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _discard_part(part_path):
+    for path in (part_path, part_path + '.source'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _report_progress(song, downloaded, total, state):
+    hook = download_progress_hook
+    if song is None or hook is None:
+        return
+    now = time.monotonic()
+    if now - state.get('last', 0) >= 0.5:
+        state['last'] = now
+        hook(song, downloaded, total)
+
+def _download_segmented(url, part_path, total, segments, song, chunk_size, attempts):
+    """Fetch url into a preallocated part_path using several Range requests at once.
+
+    Each segment is retried from where it stopped if its connection drops.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with open(part_path, 'wb') as f:
+        try:
+            os.posix_fallocate(f.fileno(), 0, total)
+        except (AttributeError, OSError):
+            f.truncate(total)
+
+    progress = {}
+    lock = threading.Lock()
+    downloaded = [0]
+
+    def fetch(start, end):
+        pos = start
+        with open(part_path, 'r+b') as f:
+            for attempt in range(attempts):
+                try:
+                    headers = {'Range': f'bytes={pos}-{end}'}
+                    with http_get(url, stream=True, timeout=30, headers=headers) as r:
+                        r.raise_for_status()
+                        if r.status_code != 206:
+                            raise DownloadError("Server stopped honouring Range requests")
+                        f.seek(pos)
+                        for chunk in r.iter_content(chunk_size=chunk_size):
+                            if not chunk:
+                                continue
+                            chunk = chunk[:end + 1 - pos]
+                            f.write(chunk)
+                            pos += len(chunk)
+                            with lock:
+                                downloaded[0] += len(chunk)
+                                _report_progress(song, downloaded[0], total, progress)
+                            if pos > end:
+                                break
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout):
+                    if attempt + 1 == attempts:
+                        raise
+                    time.sleep(min(2 ** attempt, 30))
+                if pos > end:
+                    return
+        raise DownloadError(f"Segment {start}-{end} did not complete after {attempts} attempts")
+
+    size = -(-total // segments)
+    ranges = [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        for future in [executor.submit(fetch, start, end) for start, end in ranges]:
+            future.result()
+
+def download_file(url, file_path, song=None, chunk_size=None, attempts=None, segments=None):
+    """Download url to file_path, resuming with Range requests if the connection drops.
+
+    Data is written to file_path + '.part', which is renamed into place only
+    once the size matches Content-Length and any checksum headers match, so
+    an interrupted download never looks complete. A .part file left by an
+    earlier attempt is resumed rather than downloaded again, but only if it
+    holds the same file: the url, ETag and Last-Modified it was downloaded
+    with are saved in file_path + '.part.source' and resumed requests carry
+    an If-Range header, so a server sending a different file starts over.
+
+    Files of at least SEGMENT_THRESHOLD bytes from servers that accept Range
+    requests are fetched as segments parallel byte ranges instead.
+    """
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    attempts = attempts or DOWNLOAD_ATTEMPTS
+    segments = segments or DOWNLOAD_SEGMENTS
+    part_path = file_path + '.part'
+    source_path = part_path + '.source'
+    total = None
+    digests = {}
+    progress = {}
+    segmented = False
+
+    for attempt in range(attempts):
+        offset = 0
+        source = _read_part_source(source_path)
+        validator = source and (source.get('etag') or source.get('last_modified'))
+        if os.path.exists(part_path):
+            if validator or (source and source.get('url') == url):
+                offset = os.path.getsize(part_path)
+            else:
+                # Nothing says where these bytes came from, maybe another provider
+                _discard_part(part_path)
+        if total is not None and offset >= total:
+            break
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if validator:
+                # Sends the whole file instead if it isn't the one we started
+                headers['If-Range'] = validator
+        try:
+            with http_get(url, stream=True, timeout=30, headers=headers) as r:
+                if r.status_code == 416:
+                    # Nothing left to send for our offset, start over to be safe
+                    _discard_part(part_path)
+                    continue
+                r.raise_for_status()
+                if r.status_code == 206:
+                    sent = _part_source(url, r)
+                    changed = source and any(
+                        source.get(key) and sent[key] and source[key] != sent[key]
+                        for key in ('etag', 'last_modified'))
+                    if changed:
+                        # The server ignored If-Range and is sending a different file
+                        _discard_part(part_path)
+                        continue
+                    content_range = r.headers.get('Content-Range', '')
+                    start, _, size = content_range.partition(' ')[2].partition('/')
+                    if not start.startswith(f'{offset}-'):
+                        raise DownloadError(f"Unexpected Content-Range {content_range!r}")
+                    if size.isdigit():
+                        total = int(size)
+                    mode = 'ab'
+                else:
+                    # The server ignored the range and is sending the whole file
+                    offset = 0
+                    length = r.headers.get('Content-Length')
+                    if length and length.isdigit() and not r.headers.get('Content-Encoding'):
+                        total = int(length)
+                    mode = 'wb'
+                    with open(source_path, 'w') as f:
+                        json.dump(_part_source(url, r), f)
+                digests = _expected_digests(r, full_body=r.status_code == 200) or digests
+
+                segmented = (r.status_code == 200 and segments > 1
+                             and total is not None and total >= SEGMENT_THRESHOLD
+                             and r.headers.get('Accept-Ranges', '').lower() == 'bytes')
+                if segmented:
+                    break
+
+                downloaded = offset
+                with open(part_path, mode) as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            _report_progress(song, downloaded, total, progress)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout):
+            if attempt + 1 == attempts:
+                raise
+            time.sleep(min(2 ** attempt, 30))
+            continue
+
+        if total is None or os.path.getsize(part_path) >= total:
+            break
+    else:
+        raise DownloadError(f"Download of {file_path} did not complete after {attempts} attempts")
+
+    if segmented:
+        try:
+            _download_segmented(url, part_path, total, segments, song, chunk_size, attempts)
+        except BaseException:
+            # A preallocated file can't be resumed from its size, start over next time
+            _discard_part(part_path)
+            raise
+
+    size = os.path.getsize(part_path)
+    try:
+        if total is not None and size != total:
+            raise DownloadError(f"Expected {total} bytes for {file_path}, got {size}")
+        _verify_digests(part_path, digests)
+    except DownloadError:
+        _discard_part(part_path)
+        raise
+    os.replace(part_path, file_path)
+    if os.path.exists(source_path):
+        os.remove(source_path)
+    return file_path
+
+
+def probe_audio(file_path):
+    """Return codec_name, bit_rate and format_name of a file's first audio stream.
+
+    Runs ffprobe once and returns a dict, or None if the file can't be probed.
+    """
     try:
         result = subprocess.run(
             [
                 'ffprobe', '-v', 'error', '-select_streams', 'a:0',
-                '-show_entries', 'stream=bit_rate',
-                '-of', 'default=noprint_wrappers=1:nokey=1', file_path
+                '-show_entries', 'stream=codec_name,bit_rate:format=format_name,bit_rate',
+                '-of', 'json', file_path
             ],
             capture_output=True, text=True, timeout=15
         )
-        if result.returncode == 0:
-            return int(result.stdout.strip())
+        if result.returncode != 0:
+            return None
+        info = json.loads(result.stdout)
     except Exception:
-        pass
-    return None
+        return None
+    streams = info.get('streams') or []
+    if not streams:
+        return None
+    stream, fmt = streams[0], info.get('format') or {}
+    bit_rate = stream.get('bit_rate') or fmt.get('bit_rate')
+    return {
+        'codec_name': stream.get('codec_name'),
+        'bit_rate': int(bit_rate) if bit_rate and str(bit_rate).isdigit() else None,
+        'format_name': fmt.get('format_name', ''),
+    }
+
+def get_audio_bitrate(file_path):
+    """Return the bitrate of the audio stream in bits per second or None."""
+    info = probe_audio(file_path)
+    return info['bit_rate'] if info else None
 
-def adjust_audio_format(file_path, quiet=False):
-    """Convert the downloaded file to flac or mp3 based on bitrate."""
-    bitrate = get_audio_bitrate(file_path)
+# Codecs that are kept lossless (as flac) rather than converted to mp3
+LOSSLESS_CODECS = {'flac', 'alac', 'wavpack', 'ape', 'tta', 'mlp', 'truehd'}
+
+def _is_lossless(codec):
+    return codec in LOSSLESS_CODECS or codec.startswith('pcm_')
+
+def plan_transcode(file_path, info):
+    """Decide how to bring a download into the library format.
+
+    Returns (ext, ffmpeg codec args) for the output file, or None if the file
+    can be kept as it is. Lossless audio ends up as flac, AAC as m4a and
+    everything else as mp3. The audio stream is copied rather than re-encoded
+    when it is already flac, AAC or mp3 and only the container is wrong, so
+    lossy audio is only ever re-encoded when it isn't one of those. m4a files
+    can only be tagged with mutagen, without it AAC is converted to mp3.
+    """
     ext = os.path.splitext(file_path)[1].lower()
+    if info is None or not info['codec_name']:
+        # Unknown contents, convert to mp3 unless it already claims to be one
+        return None if ext == '.mp3' else ('.mp3', ['-q:a', '0'])
+    codec = info['codec_name']
+    if codec == 'flac':
+        return None if ext == '.flac' else ('.flac', ['-c:a', 'copy'])
+    if _is_lossless(codec):
+        return ('.flac', ['-c:a', 'flac'])
+    if codec == 'mp3':
+        return None if ext == '.mp3' else ('.mp3', ['-c:a', 'copy'])
+    if codec == 'aac' and HAVE_MUTAGEN:
+        return None if ext == '.m4a' else ('.m4a', ['-c:a', 'copy'])
+    return ('.mp3', ['-c:a', 'libmp3lame', '-q:a', '0'])
+
+def _run_ffmpeg(file_path, temp_path, codec_args, tags=None, cover_path=None):
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-i', file_path]
+    if cover_path:
+        cmd += ['-i', cover_path, '-map', '0:a:0', '-map', '1:0', '-c:v', 'copy',
+                '-disposition:v:0', 'attached_pic', '-metadata:s:v', 'comment=Cover (front)']
+    else:
+        cmd += ['-map', '0:a:0', '-vn']
+    cmd += codec_args
+    if tags is not None:
+        cmd += ffmpeg_metadata_args(tags)
+    result = subprocess.run(cmd + [temp_path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0 and os.path.exists(temp_path)
+
+def adjust_audio_format(file_path, quiet=False, threads=None, tags=None):
+    """Convert the downloaded file to flac (lossless sources), m4a (AAC) or mp3.
+
+    The file is probed once and the conversion chosen by plan_transcode(),
+    so files already in the right format are left alone and streams in the
+    wrong container are copied without re-encoding. threads limits the
+    number of threads ffmpeg uses.
+
+    When a SongTags is given and the file is converted, ffmpeg writes the
+    tags (and cover, if tags.art is set) into the new file in the same pass.
+    For mp3 and flac tags.written is then set so the file doesn't need
+    tagging afterwards. ffmpeg doesn't write the publisher tag holding the
+    URI to m4a files, so those are still tagged afterwards.
+    """
+    plan = plan_transcode(file_path, probe_audio(file_path))
+    if plan is None:
+        return file_path
+    ext, codec_args = plan
+    if threads:
+        codec_args = codec_args + ['-threads', str(threads)]
+    new_path = os.path.splitext(file_path)[0] + ext
+    # Write next to the original first in case the source has the same name
+    temp_path = os.path.splitext(file_path)[0] + '.converting' + ext
+    cover_path = None
     try:
-        if bitrate and bitrate > 320000:
-            if ext != '.flac':
-                new_path = os.path.splitext(file_path)[0] + '.flac'
-                FNULL = open(os.devnull, 'w')
-                subprocess.call(['ffmpeg', '-y', '-i', file_path, new_path],
-                                stdout=FNULL, stderr=subprocess.STDOUT)
-                os.remove(file_path)
-                return new_path
+        if tags is not None and tags.art:
+            cover_path = os.path.splitext(file_path)[0] + '.cover'
+            with open(cover_path, 'wb') as f:
+                f.write(tags.art)
+            ok = _run_ffmpeg(file_path, temp_path, codec_args, tags, cover_path)
+            # The mp4 muxer drops the publisher tag, so m4a files are tagged afterwards
+            if ok and ext in ('.mp3', '.flac'):
+                tags.written = True
         else:
-            if ext != '.mp3':
-                new_path = os.path.splitext(file_path)[0] + '.mp3'
-                FNULL = open(os.devnull, 'w')
-                subprocess.call(['ffmpeg', '-y', '-i', file_path, new_path],
-                                stdout=FNULL, stderr=subprocess.STDOUT)
-                os.remove(file_path)
-                return new_path
+            ok = False
+        # Some ffmpeg builds can't attach covers to every format, the tag stage adds it instead
+        if not ok and not _run_ffmpeg(file_path, temp_path, codec_args, tags):
+            raise RuntimeError("ffmpeg failed")
+        os.replace(temp_path, new_path)
+        if new_path != file_path:
+            os.remove(file_path)
+        return new_path
     except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
         if not quiet:
             print(f"Format adjustment failed for {file_path}")
+    finally:
+        if cover_path and os.path.exists(cover_path):
+            os.remove(cover_path)
     return file_path
 
 @dataclass
@@ -79,44 +494,217 @@ class DownloadProvider:
     use_ytdlp: bool = True  # Whether to use yt-dlp for actual download
     direct_download: bool = False  # Whether to download directly without yt-dlp
     timeout: int = 300
-    
-def _ytdlp_download(song, url, quiet=False):
-    """Common yt-dlp download logic"""
-    os.makedirs(song.folder_name, exist_ok=True)
-    output_path = os.path.join(song.folder_name, song.name_file + '.%(ext)s')
+    enabled: Optional[Callable[[], bool]] = None  # Returns False when the provider isn't configured
+    refresh: Optional[Callable[[Any], Any]] = None  # Turns a cached result into a fresh download target
+    rate_limit: Optional[float] = None  # Requests started per second, None for no limit
+    burst: int = 1  # Requests that may start at once after an idle period
+    max_concurrency: Optional[int] = None  # Upper bound for the adaptive concurrency limit
+    throttle_retries: int = 3  # Times a throttled (429/403) request is retried before giving up
+
+# Status codes providers use to tell us to slow down
+THROTTLE_STATUSES = (429, 403)
+# Retry-After longer than this gives up on the provider instead of waiting
+MAX_THROTTLE_WAIT = 120
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def provider_limiter(provider: DownloadProvider, kind='search'):
+    """Return the limiter shared by all workers for a provider's searches or downloads.
+
+    Limiters are shared by name and built from the first provider asking for
+    one, so every caller should pass the provider registered in PROVIDERS.
+    """
+    key = (provider.name, kind)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = ProviderLimiter(provider.rate_limit, provider.burst,
+                                                       provider.max_concurrency)
+        return limiter
+
+def _throttle_delay(e):
+    """Return the seconds to wait if e means we are being throttled, otherwise None"""
+    if isinstance(e, Throttled):
+        return e.retry_after or 0
+    response = getattr(e, 'response', None)
+    if response is not None and getattr(response, 'status_code', None) in THROTTLE_STATUSES:
+        retry_after = response.headers.get('Retry-After', '')
+        return int(retry_after) if retry_after.isdigit() else 0
+    return None
+
+def call_limited(provider: DownloadProvider, kind, func, *args, **kwargs):
+    """Call func within the provider's rate limits.
+
+    When the provider throttles the request it is retried with exponential
+    backoff (or after Retry-After) up to provider.throttle_retries times
+    instead of failing over to the next provider straight away.
+    """
+    limiter = provider_limiter(provider, kind)
+    attempts = provider.throttle_retries + 1
+    for attempt in range(attempts):
+        limiter.acquire()
+        delay = None
+        succeeded = False
+        try:
+            result = func(*args, **kwargs)
+            succeeded = True
+        except Exception as e:
+            delay = _throttle_delay(e)
+            if delay is None or attempt + 1 == attempts or delay > MAX_THROTTLE_WAIT:
+                raise
+        finally:
+            # Always give the slot back, even if the request or the throttle check blew up
+            limiter.release(throttled=delay is not None, succeeded=succeeded)
+        if succeeded:
+            return result
+        time.sleep(max(delay, min(2 ** attempt, 60)))
+
+# Called as hook(song, downloaded_bytes, total_bytes) while yt-dlp downloads
+download_progress_hook = None
+
+def set_download_progress_hook(hook):
+    """Report yt-dlp download progress to hook, or None to stop reporting"""
+    global download_progress_hook
+    download_progress_hook = hook
+
+class YtDlpEngine:
+    """In-process yt-dlp downloads using one reusable YoutubeDL per worker.
+
+    Running the yt-dlp command re-imports its whole extractor registry for
+    every track. The engine instead keeps a YoutubeDL object per worker
+    thread (and audio format) and reports progress through
+    download_progress_hook.
+    """
+
+    def __init__(self):
+        import yt_dlp
+        self.yt_dlp = yt_dlp
+        self.local = threading.local()
+
+    def _instance(self, audio_format):
+        instances = getattr(self.local, 'instances', None)
+        if instances is None:
+            instances = self.local.instances = {}
+        ydl = instances.get(audio_format)
+        if ydl is None:
+            ydl = self.yt_dlp.YoutubeDL({
+                'format': 'bestaudio/best',
+                'quiet': True,
+                'no_warnings': True,
+                'noprogress': True,
+                'socket_timeout': 30,
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': audio_format,
+                    'preferredquality': '0',
+                }],
+                'progress_hooks': [self._progress],
+            })
+            instances[audio_format] = ydl
+        return ydl
+
+    def _progress(self, d):
+        song = getattr(self.local, 'song', None)
+        hook = download_progress_hook
+        if song is None or hook is None or d.get('status') != 'downloading':
+            return
+        # yt-dlp calls this for every block, only pass on a few updates a second
+        now = time.monotonic()
+        if now - getattr(self.local, 'last_report', 0) < 0.5:
+            return
+        self.local.last_report = now
+        hook(song, d.get('downloaded_bytes') or 0,
+             d.get('total_bytes') or d.get('total_bytes_estimate'))
+
+    def download(self, url, output_path, audio_format='best', song=None):
+        """Download url as audio to output_path (a yt-dlp template). Returns True on success."""
+        ydl = self._instance(audio_format)
+        ydl.params['outtmpl'] = {'default': output_path}
+        self.local.song = song
+        try:
+            return ydl.download([url]) == 0
+        except Exception as e:
+            if _is_throttle_message(str(e)):
+                raise Throttled(str(e)) from e
+            return False
+        finally:
+            self.local.song = None
+
+def _is_throttle_message(text):
+    """Return True if a yt-dlp error says the site is rate limiting us.
+
+    Only 429 counts: on YouTube a 403 usually means the video is unavailable
+    or its signature couldn't be solved, which waiting won't fix.
+    """
+    return 'HTTP Error 429' in text
+
+_ytdlp_engine = None
+_ytdlp_engine_lock = threading.Lock()
+
+def _ytdlp_fetch(song, url, output_path, audio_format='best'):
+    """Download url with yt-dlp in-process, or with the yt-dlp command if the module is missing"""
+    global _ytdlp_engine
+    with _ytdlp_engine_lock:
+        if _ytdlp_engine is None:
+            try:
+                _ytdlp_engine = YtDlpEngine()
+            except ImportError:
+                _ytdlp_engine = False
+    if _ytdlp_engine:
+        return _ytdlp_engine.download(url, output_path, audio_format, song=song)
+
     cmd = [
-        'yt-dlp', '--extract-audio', '--audio-format', 'best',
+        'yt-dlp', '--extract-audio', '--audio-format', audio_format,
         '--audio-quality', '0', '--output', output_path, url
     ]
     result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-    if result.returncode != 0:
+    if result.returncode != 0 and _is_throttle_message(result.stderr):
+        raise Throttled(result.stderr.strip().splitlines()[-1])
+    return result.returncode == 0
+
+# Files written next to a song while it downloads or converts, never the song itself
+TEMP_EXTENSIONS = ('.part', '.source', '.cover', '.ytdl', '.temp', '.tmp')
+
+def find_download(folder_name, name_file):
+    """Return the file yt-dlp saved as name_file.<ext> in folder_name, or None.
+
+    Only files named exactly name_file plus an extension count, so partial
+    downloads (name.mp3.part), ffmpeg output (name.converting.mp3) and songs
+    whose names merely start with name_file are never picked up. If several
+    match the newest is returned.
+    """
+    found = []
+    for f in os.listdir(folder_name):
+        stem, ext = os.path.splitext(f)
+        if stem == name_file and ext.lower() not in TEMP_EXTENSIONS:
+            path = os.path.join(folder_name, f)
+            found.append((os.path.getmtime(path), path))
+    return max(found)[1] if found else None
+
+def _ytdlp_download(song, url, quiet=False, transcode=True):
+    """Common yt-dlp download logic"""
+    os.makedirs(song.folder_name, exist_ok=True)
+    output_path = os.path.join(song.folder_name, song.name_file + '.%(ext)s')
+    if not _ytdlp_fetch(song, url, output_path):
         return False
     
     # Find downloaded file
-    for f in os.listdir(song.folder_name):
-        if f.startswith(song.name_file):
-            song.file = os.path.join(song.folder_name, f)
-            break
-    
+    song.file = find_download(song.folder_name, song.name_file)
     if not song.file:
         return False
     
-    song.file = adjust_audio_format(song.file, quiet=quiet)
+    if transcode:
+        song.file = adjust_audio_format(song.file, quiet=quiet)
     return True
 
-def _direct_download(song, url, quiet=False):
+def _direct_download(song, url, quiet=False, transcode=True):
     """Direct download without yt-dlp"""
     os.makedirs(song.folder_name, exist_ok=True)
     fname = os.path.join(song.folder_name, song.name_file + '.mp3')
-    
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(fname, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-    
-    song.file = adjust_audio_format(fname, quiet=quiet)
+    download_file(url, fname, song=song)
+
+    song.file = adjust_audio_format(fname, quiet=quiet) if transcode else fname
     return True
 
 def _qobuz_download(song, url_data, quiet=False):
@@ -134,48 +722,90 @@ def _qobuz_download(song, url_data, quiet=False):
 
     os.makedirs(song.folder_name, exist_ok=True)
     fname = os.path.join(song.folder_name, song.name_file + ext)
-
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(fname, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+    download_file(url, fname, song=song)
 
     song.file = fname
     return True
 
-def _generic_download(song, provider: DownloadProvider, quiet=False):
-    """Generic download function that works with any provider"""
+# Search result cache shared by all workers, see set_resolution_cache()
+resolution_cache = None
+
+def set_resolution_cache(cache):
+    """Use a ResolutionCache for provider and YouTube searches, or None to disable"""
+    global resolution_cache
+    resolution_cache = cache
+
+def _provider_query(song):
+    """Search query used by every provider for a song"""
+    return f"{song.name} {song.artists[0]}"
+
+def resolve_source(song, provider: DownloadProvider, quiet=False):
+    """Return the download target a provider finds for a song, or None"""
+    if provider.enabled is not None and not provider.enabled():
+        return None
+
+    cached = resolution_cache.get(song.uri, provider.name) if resolution_cache else MISS
+    if cached is not MISS:
+        if cached is None or provider.refresh is None:
+            return cached
+        try:
+            target = call_limited(provider, 'search', provider.refresh, cached)
+            if target:
+                return target
+        except Exception as e:
+            if not quiet:
+                print(f"{provider.name} cached result expired for {song.name}: {e}")
+
+    try:
+        target = call_limited(provider, 'search', provider.url_resolver, _provider_query(song))
+    except Exception as e:
+        if not quiet:
+            print(f"{provider.name} search failed for {song.name}: {e}")
+        return None
+
+    if resolution_cache is not None:
+        resolution_cache.put(song.uri, provider.name, target)
+    return target
+
+def fetch_source(song, provider: DownloadProvider, target, quiet=False, transcode=True):
+    """Download a resolved target into song.file, returning True on success.
+
+    With transcode=False the file is left in the format the provider served
+    so that conversion can be done separately.
+    """
     try:
-        query = f"{song.name} {song.artists[0]}"
-        
         # Special handling for Qobuz
         if provider.name == 'Qobuz':
-            url_data = provider.url_resolver(query)
-            return _qobuz_download(song, url_data, quiet)
-        
-        url = provider.url_resolver(query)
-        
-        if not url:
-            return False
-        
-        if provider.direct_download:
-            return _direct_download(song, url, quiet)
+            ok = call_limited(provider, 'download', _qobuz_download, song, target, quiet)
+        elif provider.direct_download:
+            ok = call_limited(provider, 'download', _direct_download, song, target, quiet, transcode)
         else:
-            return _ytdlp_download(song, url, quiet)
-            
+            ok = call_limited(provider, 'download', _ytdlp_download, song, target, quiet, transcode)
+
     except Exception as e:
         if not quiet:
             print(f"{provider.name} download failed for {song.name}: {e}")
+        ok = False
+
+    if not ok and resolution_cache is not None:
+        # Search again next run rather than retrying a source that failed
+        resolution_cache.forget(song.uri, provider.name)
+    return ok
+
+def _generic_download(song, provider: DownloadProvider, quiet=False):
+    """Generic download function that works with any provider"""
+    target = resolve_source(song, provider, quiet)
+    if not target:
         return False
+    return fetch_source(song, provider, target, quiet)
 
 # URL resolver functions for each provider
 def _resolve_bandcamp_url(query):
     """Find Bandcamp URL for a search query"""
     search_url = f"https://bandcamp.com/search?q={urllib.parse.quote(query)}"
-    res = requests.get(search_url, timeout=15)
+    res = http_get(search_url, timeout=15)
     res.raise_for_status()
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(res.text, 'html.parser')
     link_tag = soup.select_one('li.searchresult a.itemurl')
     return link_tag['href'] if link_tag and link_tag.get('href') else None
@@ -194,7 +824,7 @@ def _resolve_jamendo_url(query):
         f"https://api.jamendo.com/v3.0/tracks/?client_id={client_id}&format=json"
         f"&limit=1&search={urllib.parse.quote(query)}"
     )
-    res = requests.get(api_url, timeout=15)
+    res = http_get(api_url, timeout=15)
     res.raise_for_status()
     data = res.json()
     tracks = data.get('results')
@@ -202,73 +832,168 @@ def _resolve_jamendo_url(query):
         return None
     return tracks[0].get('audiodownload') or tracks[0].get('audio')
 
-def _resolve_qobuz_url(query):
-    """Find Qobuz track and return download data"""
-    q_email = os.getenv("QOBUZ_EMAIL")
-    q_pass = os.getenv("QOBUZ_PASSWORD")
-    q_app_id = os.getenv("QOBUZ_APP_ID")
-    q_secrets = os.getenv("QOBUZ_SECRETS")
+def _is_qobuz_auth_error(error):
+    """Return True if a Qobuz API error means the user token is no longer valid"""
+    if type(error).__name__ == 'AuthenticationError':
+        return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 401
 
-    if not all([q_email, q_pass, q_app_id, q_secrets]):
-        return None
+class QobuzSession:
+    """Process-wide Qobuz client shared by all download workers.
 
-    try:
-        from qobuz_dl.qopy import Client
-    except Exception:
-        return None
+    Logging in and validating the app secrets takes several round-trips, so
+    the client is created once on first use. If a call fails because the
+    user token has expired the client logs in again and the call is retried.
+    """
 
-    try:
-        secrets = [s for s in q_secrets.split(',') if s]
-        client = Client(q_email, q_pass, q_app_id, secrets)
-        res = client.search_tracks(query, limit=1)
-        items = res.get('tracks', {}).get('items', [])
-        if not items:
-            return None
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.client = None
+        self.login_failed = False
 
-        track_id = items[0]['id']
+    def get_client(self, stale=None):
+        """Return the logged in client, or None if Qobuz is not available.
+
+        Passing the client that just failed as stale forces a new login,
+        unless another worker has already replaced it.
+        """
+        with self.lock:
+            if self.client is not None and self.client is not stale:
+                return self.client
+            if self.login_failed and stale is None:
+                return None
+
+            q_email = os.getenv("QOBUZ_EMAIL")
+            q_pass = os.getenv("QOBUZ_PASSWORD")
+            q_app_id = os.getenv("QOBUZ_APP_ID")
+            q_secrets = os.getenv("QOBUZ_SECRETS")
+
+            if not all([q_email, q_pass, q_app_id, q_secrets]):
+                return None
 
-        # Try hi-res >96kHz then <96kHz then lossless
-        fmt_ids = [27, 7, 6]
-        track_data = None
-        for fmt in fmt_ids:
             try:
-                track_data = client.get_track_url(track_id, fmt_id=fmt)
-                if 'url' in track_data:
-                    break
+                from qobuz_dl.qopy import Client
             except Exception:
-                track_data = None
-        if not track_data or 'url' not in track_data:
-            # Fallback to 320k mp3
-            track_data = client.get_track_url(track_id, fmt_id=5)
+                return None
 
-        return track_data
-    except Exception:
+            try:
+                secrets = [s for s in q_secrets.split(',') if s]
+                self.client = Client(q_email, q_pass, q_app_id, secrets)
+                self.login_failed = False
+            except Exception:
+                # Don't retry a bad login for every track
+                self.client = None
+                self.login_failed = True
+            return self.client
+
+    def call(self, method, *args, **kwargs):
+        """Call a Client method, logging in again once if the token expired"""
+        client = self.get_client()
+        if client is None:
+            return None
+        try:
+            return getattr(client, method)(*args, **kwargs)
+        except Exception as e:
+            if not _is_qobuz_auth_error(e):
+                raise
+        client = self.get_client(stale=client)
+        if client is None:
+            return None
+        return getattr(client, method)(*args, **kwargs)
+
+qobuz_session = QobuzSession()
+
+def _qobuz_track_data(track_id):
+    """Return download data for a Qobuz track in the best available quality"""
+    # Try hi-res >96kHz then <96kHz then lossless
+    fmt_ids = [27, 7, 6]
+    track_data = None
+    for fmt in fmt_ids:
+        try:
+            track_data = qobuz_session.call('get_track_url', track_id, fmt_id=fmt)
+            if track_data and 'url' in track_data:
+                break
+        except Exception:
+            track_data = None
+    if not track_data or 'url' not in track_data:
+        # Fallback to 320k mp3
+        track_data = qobuz_session.call('get_track_url', track_id, fmt_id=5)
+    if track_data:
+        track_data['track_id'] = track_id
+    return track_data
+
+def _resolve_qobuz_url(query):
+    """Find Qobuz track and return download data"""
+    res = qobuz_session.call('search_tracks', query, limit=1)
+    if not res:
+        return None
+    items = res.get('tracks', {}).get('items', [])
+    if not items:
         return None
 
+    return _qobuz_track_data(items[0]['id'])
+
+def _refresh_qobuz_url(cached):
+    """Get a new signed download url for a cached Qobuz result"""
+    return _qobuz_track_data(cached['track_id'])
+
 # Provider configurations
 PROVIDERS = {
     'qobuz': DownloadProvider(
         name='Qobuz',
         url_resolver=_resolve_qobuz_url,
-        direct_download=True  # Uses special _qobuz_download function
+        direct_download=True,  # Uses special _qobuz_download function
+        enabled=lambda: qobuz_session.get_client() is not None,
+        refresh=_refresh_qobuz_url,
+        rate_limit=5,
+        burst=5,
+        max_concurrency=4
     ),
     'bandcamp': DownloadProvider(
         name='Bandcamp',
         url_resolver=_resolve_bandcamp_url,
-        use_ytdlp=True
+        use_ytdlp=True,
+        rate_limit=2,  # searches scrape the HTML site
+        burst=4,
+        max_concurrency=4
     ),
     'soundcloud': DownloadProvider(
         name='SoundCloud', 
         url_resolver=_resolve_soundcloud_url,
-        use_ytdlp=True
+        use_ytdlp=True,
+        rate_limit=4,
+        burst=4
     ),
     'jamendo': DownloadProvider(
         name='Jamendo',
         url_resolver=_resolve_jamendo_url,
-        direct_download=True
+        direct_download=True,
+        enabled=lambda: bool(os.getenv('JAMENDO_CLIENT_ID')),
+        rate_limit=5,
+        burst=5
     )
 }
 
+# Limits for YouTube searches and downloads, which are the fallback rather than a provider
+YOUTUBE_LIMITS = DownloadProvider(
+    name='YouTube',
+    url_resolver=lambda query: None,
+    max_concurrency=8
+)
+
+# Limits for album cover downloads
+ART_LIMITS = DownloadProvider(
+    name='Album art',
+    url_resolver=lambda query: None
+)
+
+# High quality providers tried in order before falling back to YouTube
+PROVIDER_ORDER = ['qobuz', 'bandcamp', 'soundcloud', 'jamendo']
+
+# Seconds to wait for each provider's search when racing them
+RACE_TIMEOUT = 30
+
 def register_provider(key: str, provider: DownloadProvider):
     """Register a new download provider"""
     PROVIDERS[key] = provider
@@ -290,36 +1015,316 @@ def download_from_bandcamp(song, quiet=False):
 
 def download_from_soundcloud(song, quiet=False):
     """Download audio from SoundCloud via yt-dlp search."""
-    return _generic_download(song, DownloadProvider(
-        name='SoundCloud',
-        url_resolver=_resolve_soundcloud_url,
-        use_ytdlp=True
-    ), quiet)
+    return _generic_download(song, PROVIDERS['soundcloud'], quiet)
 
 def download_from_jamendo(song, quiet=False):
     """Download from Jamendo using its open API."""
     return _generic_download(song, PROVIDERS['jamendo'], quiet)
 
+#apply metadata to a downloaded song, unless the transcode already did
+def tagSong(song, quiet=False):
+    if not song.tagged:
+        song.set_file_attributes(quiet=quiet)
+    # songs stay in their playlist for the whole run, don't keep the cover alive with them
+    song.art_future = None
+
+art_cache = None
+_art_cache_lock = threading.Lock()
+
+# Threads downloading album covers ahead of the audio, see Song.prefetch_art()
+ART_PREFETCH_WORKERS = 4
+_art_executor = None
+
+def set_art_cache(cache):
+    """Use an ArtCache for album covers. By default one is created on first use."""
+    global art_cache
+    art_cache = cache
+
+def _get_art_cache():
+    global art_cache
+    with _art_cache_lock:
+        if art_cache is None:
+            art_cache = ArtCache()
+        return art_cache
+
+def _get_art_executor():
+    global _art_executor
+    with _art_cache_lock:
+        if _art_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _art_executor = ThreadPoolExecutor(max_workers=ART_PREFETCH_WORKERS,
+                                               thread_name_prefix='art')
+        return _art_executor
+
+def _get_art(url):
+    res = http_get(url, timeout=30)
+    res.raise_for_status()
+    return res.content
+
+def _fetch_art(url):
+    """Download an image, returning its bytes"""
+    return call_limited(ART_LIMITS, 'download', _get_art, url)
+
+
+# Number of long-lived yt-dlp instances used for YouTube searches
+YOUTUBE_SEARCH_INSTANCES = 3
+
+def _video_from_info(video_info):
+    """Convert a flat yt-dlp search entry into the dict used for scoring"""
+    return {
+        'url': f"https://www.youtube.com/watch?v={video_info['id']}",
+        'duration': video_info.get('duration') or 0,
+        'title': video_info.get('title') or ''
+    }
+
+class YouTubeSearchEngine:
+    """Runs YouTube searches for many songs through long-lived yt-dlp instances.
+
+    Launching yt-dlp for every search pays for interpreter startup and
+    extractor initialisation each time. The engine keeps a few YoutubeDL
+    objects alive in worker threads that take queries from a shared queue.
+    If the yt_dlp module can't be imported, queued queries are instead
+    batched into a single yt-dlp process and its output is handed back per
+    query as it streams in.
+    """
+
+    def __init__(self, instances=YOUTUBE_SEARCH_INSTANCES, batch_size=20):
+        import queue
+
+        self.requests = queue.Queue()
+        self.batch_size = batch_size
+        try:
+            import yt_dlp
+            self.yt_dlp = yt_dlp
+        except ImportError:
+            self.yt_dlp = None
+        for i in range(instances):
+            threading.Thread(target=self._run, name=f"youtube-search-{i}", daemon=True).start()
+
+    def search(self, query, count=15):
+        """Queue a search, returning a Future for the list of videos found"""
+        from concurrent.futures import Future
+
+        future = Future()
+        self.requests.put((query, count, future))
+        return future
+
+    def _run(self):
+        if self.yt_dlp is not None:
+            self._run_api()
+        else:
+            self._run_subprocess()
+
+    def _run_api(self):
+        ydl = self.yt_dlp.YoutubeDL({
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': True,
+            'skip_download': True,
+        })
+        while True:
+            query, count, future = self.requests.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                info = ydl.extract_info(f'ytsearch{count}:{query}', download=False)
+                videos = [_video_from_info(entry) for entry in (info or {}).get('entries') or []
+                          if entry and entry.get('id')]
+                if not videos:
+                    raise Exception("No videos found")
+                future.set_result(videos)
+            except Exception as e:
+                future.set_exception(e)
+
+    def _run_subprocess(self):
+        import queue
+
+        while True:
+            batch = [self.requests.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            self._search_batch(batch)
+
+    def _search_batch(self, batch):
+        waiting = {}  # query -> futures waiting on it
+        urls = []
+        for query, count, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            if query not in waiting:
+                waiting[query] = []
+                urls.append(f'ytsearch{count}:{query}')
+            waiting[query].append(future)
+        if not urls:
+            return
+
+        results = {}
+
+        def finish(query):
+            videos = results.get(query)
+            for future in waiting.pop(query, []):
+                if videos:
+                    future.set_result(videos)
+                else:
+                    future.set_exception(Exception("No videos found"))
+
+        try:
+            proc = subprocess.Popen(
+                ['yt-dlp', '--dump-json', '--no-download', '--flat-playlist',
+                 '--ignore-errors'] + urls,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+            )
+        except Exception as e:
+            for futures in waiting.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        # Kill searches that hang, allowing the old 30 seconds per query
+        watchdog = threading.Timer(30 * len(urls), proc.kill)
+        watchdog.start()
+        try:
+            current = None
+            current_id = None
+            for line in proc.stdout:
+                try:
+                    video_info = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                # Entries of a search "playlist" carry the query as playlist_id.
+                # Results come back in the order the searches were given, so
+                # fall back to the next unanswered query if it doesn't match.
+                playlist_id = video_info.get('playlist_id') or video_info.get('playlist')
+                if current is None or playlist_id != current_id:
+                    if current is not None:
+                        finish(current)
+                    current_id = playlist_id
+                    current = playlist_id if playlist_id in waiting else next(iter(waiting), None)
+                if current is not None and video_info.get('id'):
+                    results.setdefault(current, []).append(_video_from_info(video_info))
+            proc.wait()
+        finally:
+            watchdog.cancel()
+            for query in list(waiting):
+                finish(query)
+
+_youtube_search_engine = None
+_youtube_search_lock = threading.Lock()
+
+def _youtube_search(query, count=15):
+    """Return title, duration and url of the top YouTube results for a query.
+
+    Searches run within YOUTUBE_LIMITS, so a 429 from YouTube backs off and
+    retries like a throttled download.
+    """
+    global _youtube_search_engine
+    with _youtube_search_lock:
+        if _youtube_search_engine is None:
+            _youtube_search_engine = YouTubeSearchEngine()
+    return call_limited(YOUTUBE_LIMITS, 'search', _youtube_search_once,
+                        _youtube_search_engine, query, count)
+
+def _youtube_search_once(engine, query, count):
+    try:
+        return engine.search(query, count).result(timeout=300)
+    except Exception as e:
+        if _is_throttle_message(str(e)):
+            raise Throttled(str(e)) from e
+        raise
+
 #download a song using song object
 def downloadSong(song, quiet=False):
     if not quiet:
         print("Downloading", song.name)
     song.download(quiet=quiet)
     if song.file and os.path.exists(song.file):
-        song.set_file_attributes(quiet=quiet)
-        # Delete album art after metadata has been applied
-        if getattr(song, 'art', None) and os.path.exists(song.art):
-            try:
-                os.remove(song.art)
-            except FileNotFoundError:
-                pass
-            song.art = None
+        tagSong(song, quiet=quiet)
         if not quiet:
             print(song.name, "Downloaded")
     else:
         if not quiet:
             print(f"Failed to download {song.name}")
 
+# returns the playlist object for a playlist url or uri
+def getPlaylist(playlist_url, sp, fields=None):
+    """Return (playlist, playlist_user) for a Spotify playlist URL or URI.
+
+    playlist_user is None for https://open.spotify.com/playlist/ links. Pass
+    fields to only request part of the playlist object.
+    """
+    if 'https://open.spotify.com/playlist/' in playlist_url:
+        # New format: https://open.spotify.com/playlist/ID
+        playlist_id = playlist_url.split('playlist/')[1].split('?')[0]
+        return sp.playlist(playlist_id, fields=fields), None
+    elif 'https://open.spotify.com/user/' in playlist_url:
+        # Old format: https://open.spotify.com/user/USER/playlist/ID
+        playlist_user = playlist_url.split('user/')[1].split('/')[0]
+        playlist_id = playlist_url.split('playlist/')[1]
+        playlist_id = playlist_id.split('?', 1)[0]
+    else:
+        # Spotify URI format
+        playlist_user = playlist_url.split(':')[0]
+        playlist_id = playlist_url.split(':')[-1]
+        playlist_id = playlist_id.split('?', 1)[0]
+    return sp.user_playlist(playlist_user, playlist_id, fields=fields), playlist_user
+
+# Tracks per request and requests in flight when fetching playlist pages
+PAGE_SIZE = 100
+PAGE_WORKERS = 4
+
+def _fetch_page(sp, playlist_id, offset, attempts=5):
+    """Fetch one page of playlist items, waiting out Spotify rate limits"""
+    import spotipy
+
+    for attempt in range(attempts):
+        try:
+            return sp.playlist_items(playlist_id, offset=offset, limit=PAGE_SIZE)
+        except spotipy.SpotifyException as e:
+            if e.http_status != 429 or attempt == attempts - 1:
+                raise
+            retry_after = (e.headers or {}).get('Retry-After', 1)
+            time.sleep(int(retry_after) + 1)
+
+# Only what is needed to decide whether and how to page through a playlist
+PLAYLIST_FIELDS = 'id,name,snapshot_id,tracks.total'
+
+def _songs_from_pages(pages, folder_name, count):
+    """Yield Songs from page futures in order, stopping after count songs"""
+    yielded = 0
+    try:
+        for page in pages:
+            for track in page.result()['items']:
+                if yielded >= count:
+                    return
+                yield Song(track['track'], folder_name)
+                yielded += 1
+    finally:
+        # Stop fetching if the consumer gave up early
+        for page in pages:
+            page.cancel()
+
+def iterTracks(sp, playlist, limit=None):
+    """Return an iterator of Song objects for a playlist, in playlist order.
+
+    Every page needed is requested by offset straight away, PAGE_WORKERS at
+    a time, so songs from the first page can be used while later pages are
+    still being fetched. playlist must contain id, name and tracks.total.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    total_tracks = playlist['tracks']['total']
+    count = total_tracks if limit is None else min(limit, total_tracks)
+
+    # Only request the pages needed to reach the limit
+    executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS)
+    pages = [executor.submit(_fetch_page, sp, playlist['id'], offset)
+             for offset in range(0, count, PAGE_SIZE)]
+    executor.shutdown(wait=False)
+    return _songs_from_pages(pages, playlist['name'], count)
+
 # returns a list of all track objects from a playlist
 def getTracks(playlist_url, sp, limit=None):
     """Return a list of Song objects from a playlist.
@@ -336,22 +1341,7 @@ def getTracks(playlist_url, sp, limit=None):
     from tqdm import tqdm
 
     allTracks = []
-    if 'https://open.spotify.com/playlist/' in playlist_url:
-        # New format: https://open.spotify.com/playlist/ID
-        playlist_id = playlist_url.split('playlist/')[1].split('?')[0]
-        playlist = sp.playlist(playlist_id)
-    elif 'https://open.spotify.com/user/' in playlist_url:
-        # Old format: https://open.spotify.com/user/USER/playlist/ID
-        playlist_user = playlist_url.split('user/')[1].split('/')[0]
-        playlist_id = playlist_url.split('playlist/')[1]
-        playlist_id = playlist_id.split('?', 1)[0]
-        playlist = sp.user_playlist(playlist_user, playlist_id)
-    else:
-        # Spotify URI format
-        playlist_user = playlist_url.split(':')[0]
-        playlist_id = playlist_url.split(':')[-1]
-        playlist_id = playlist_id.split('?', 1)[0]
-        playlist = sp.user_playlist(playlist_user, playlist_id)
+    playlist, _ = getPlaylist(playlist_url, sp, fields=PLAYLIST_FIELDS)
 
     # Get total track count for progress bar
     total_tracks = playlist['tracks']['total']
@@ -362,48 +1352,98 @@ def getTracks(playlist_url, sp, limit=None):
     progress_bar = tqdm(total=progress_total, desc="Getting playlist tracks", unit="track",
                        bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]')
 
-    if 'https://open.spotify.com/playlist/' in playlist_url:
-        # For new format, use playlist_tracks
-        results = sp.playlist_tracks(playlist['id'])
-        tracks = results
-        for track in tracks['items']:
-            allTracks.append(Song(track['track'], playlist['name']))
-            progress_bar.update(1)
-            if limit is not None and len(allTracks) >= limit:
-                progress_bar.close()
-                return allTracks, playlist['name']
-
-        while tracks['next'] and (limit is None or len(allTracks) < limit):
-            tracks = sp.next(tracks)
-            for track in tracks['items']:
-                allTracks.append(Song(track['track'], playlist['name']))
-                progress_bar.update(1)
-                if limit is not None and len(allTracks) >= limit:
-                    progress_bar.close()
-                    return allTracks, playlist['name']
-    else:
-        # For old format, use user_playlist
-        results = sp.user_playlist(playlist_user, playlist['id'], fields="tracks,next")
-        tracks = results['tracks']
-        for track in tracks['items']:
-            allTracks.append(Song(track['track'], playlist['name']))
-            progress_bar.update(1)
-            if limit is not None and len(allTracks) >= limit:
-                progress_bar.close()
-                return allTracks, playlist['name']
-
-        while tracks['next'] and (limit is None or len(allTracks) < limit):
-            tracks = sp.next(tracks)
-            for track in tracks['items']:
-                allTracks.append(Song(track['track'], playlist['name']))
-                progress_bar.update(1)
-                if limit is not None and len(allTracks) >= limit:
-                    progress_bar.close()
-                    return allTracks, playlist['name']
+    for song in iterTracks(sp, playlist, limit=limit):
+        allTracks.append(song)
+        progress_bar.update(1)
 
     progress_bar.close()
     return allTracks, playlist['name']
 
+def _slim_track(track):
+    """Keep only the parts of a track object that Song uses"""
+    return {
+        'name': track['name'],
+        'track_number': track.get('track_number'),
+        'artists': [{'name': artist['name']} for artist in track['artists']],
+        'duration_ms': track['duration_ms'],
+        'album': {
+            'name': track['album']['name'],
+            'release_date': track['album']['release_date'],
+            'images': [{'url': image['url']} for image in track['album']['images']],
+        },
+        'uri': track['uri'],
+    }
+
+@dataclass
+class PlaylistSync:
+    """Tracks of a playlist and how they changed since the last sync.
+
+    Unless the playlist is unchanged, songs is filled in as stream() is
+    consumed and added/removed are only known once it has finished.
+    """
+    name: str
+    total: int  # number of songs the playlist will yield
+    playlist_id: Optional[str] = None
+    snapshot_id: Optional[str] = None
+    unchanged: bool = False  # snapshot_id matched, songs came from the stored listing
+    songs: list = field(default_factory=list)
+    added: Optional[set] = None  # URIs added since the last sync, None if there wasn't one
+    removed: Optional[set] = None  # URIs removed since the last sync, None if there wasn't one
+    previous: Optional[list] = None  # stored track listing from the last sync
+    pending: Optional[Iterator] = None  # songs still being fetched
+
+    def stream(self):
+        """Yield the playlist's songs in order as their pages arrive."""
+        if self.pending is None:
+            yield from self.songs
+            return
+        for song in self.pending:
+            self.songs.append(song)
+            yield song
+        self.pending = None
+        if self.previous is not None:
+            old_uris = {track['uri'] for track in self.previous}
+            new_uris = {song.uri for song in self.songs}
+            self.added = new_uris - old_uris
+            self.removed = old_uris - new_uris
+
+def syncTracks(playlist_url, sp, snapshots, limit=None):
+    """Return a PlaylistSync for a playlist using its stored snapshot.
+
+    Only the playlist's name, size and snapshot_id are requested first. If
+    the snapshot matches the one stored in snapshots (a PlaylistSnapshots)
+    the stored track listing is used without paging through the playlist.
+    Otherwise fetching the pages starts in the background and the songs are
+    compared with the stored listing as they are streamed. Snapshots are not
+    used when limit is given since only part of the playlist is fetched.
+    """
+    playlist, _ = getPlaylist(playlist_url, sp, fields=PLAYLIST_FIELDS)
+
+    stored = None
+    if snapshots is not None and limit is None:
+        stored = snapshots.get(playlist['id'])
+    if stored and stored['snapshot_id'] == playlist['snapshot_id']:
+        songs = [Song(track, playlist['name']) for track in stored['tracks']]
+        return PlaylistSync(playlist['name'], len(songs), playlist['id'], playlist['snapshot_id'],
+                            unchanged=True, songs=songs, added=set(), removed=set())
+
+    total_tracks = playlist['tracks']['total']
+    sync = PlaylistSync(playlist['name'],
+                        total_tracks if limit is None else min(limit, total_tracks),
+                        previous=stored['tracks'] if stored else None,
+                        pending=iterTracks(sp, playlist, limit=limit))
+    if limit is None:
+        sync.playlist_id = playlist['id']
+        sync.snapshot_id = playlist['snapshot_id']
+    return sync
+
+def saveSnapshot(sync, snapshots):
+    """Store a fully synced playlist so the next run can skip unchanged playlists"""
+    if sync.playlist_id is None or sync.pending is not None:
+        return
+    snapshots.put(sync.playlist_id, sync.snapshot_id, sync.name,
+                  [_slim_track(song.track) for song in sync.songs])
+
 #delete all images in specified folder
 def deleteAllImages(folder_name):
     for file in os.listdir(folder_name):
@@ -413,26 +1453,32 @@ def deleteAllImages(folder_name):
 #Get URI from publisher attribute of mp3 file
 def getUri(file):
     try:
-        audiofile = eyed3.load(file)
-        
-        # Check if eyed3 successfully loaded the file
-        if audiofile is None or audiofile.tag is None:
-            return None
-
-        return audiofile.tag.publisher
-
-    except (TypeError, AttributeError) as e:
+        return read_uri(file)
+    except Exception as e:
         print("Error loading song for getting uri")
         print(e)
         return None
 
-    except UnboundLocalError:
-        return None
-
 #Delete all songs from playlist folder that aren't in playlist
-def delRemoved(playlistFolderURIs, songs, folder_name):
-    playlistURIs = (song.uri for song in songs)
-    songsToDel = set(playlistFolderURIs) - set(playlistURIs)
+def delRemoved(playlistFolderURIs, songs, folder_name, library=None):
+    """Delete files in folder_name whose URI is no longer in the playlist.
+
+    When a LibraryIndex is given the files to delete are looked up by URI in
+    the index instead of re-reading the tags of every file, and deleted files
+    are dropped from it.
+    """
+    playlistURIs = {song.uri for song in songs}
+    songsToDel = set(playlistFolderURIs) - playlistURIs
+    if library is not None:
+        for uri in songsToDel:
+            for file_path in library.paths(uri, folder_name):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                library.remove(file_path)
+        return
+
     for root, _, files in os.walk(folder_name):
         for file in files:
             file_path = os.path.join(root, file)
@@ -463,85 +1509,35 @@ class Song():
         self.album_year = track['album']['release_date'][:4]
         self.art_urls = [art['url'] for art in track['album']['images']]
         self.uri = track['uri']
+        self.file = None
+        self.source = None
+        self.resolved = {}  # provider key -> target found this run
+        self.art_future = None
+        self.tagged = False  # the file has its tags, from the transcode or tagSong()
 
         artist_folder = sanitize_filename(self.artists[0])
         album_folder = sanitize_filename(f"({self.album_year}) {self.album}")
         self.folder_name = os.path.join(folder_name, artist_folder, album_folder)
 
     def get_link(self, quiet=False):
-        import json
-        import subprocess
-        
         textToSearch = self.name + ' ' + self.artists[0]
         
         try:
-            # Use yt-dlp to search YouTube
-            search_cmd = [
-                'yt-dlp',
-                '--dump-json',
-                '--no-download',
-                '--flat-playlist',
-                f'ytsearch15:{textToSearch}'
-            ]
-            
-            result = subprocess.run(search_cmd, capture_output=True, text=True, timeout=30)
-            
-            if result.returncode != 0:
-                raise Exception(f"yt-dlp search failed: {result.stderr}")
-            
-            videos = []
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    try:
-                        video_info = json.loads(line)
-                        videos.append({
-                            'url': f"https://www.youtube.com/watch?v={video_info['id']}",
-                            'duration': video_info.get('duration', 0),
-                            'title': video_info.get('title', '')
-                        })
-                    except json.JSONDecodeError:
-                        continue
-            
-            if not videos:
-                raise Exception("No videos found")
-            
-            # Score videos based on title similarity and duration difference
-            import difflib
-
-            query = (self.name + ' ' + self.artists[0]).lower()
-            bestScore = None
-            bestVideo = None
-            backupVid = None
-
-            for video in videos:
-                title = video['title'].lower()
-                ratio = difflib.SequenceMatcher(None, query, title).ratio()
-                penalty = 0
-                if video['duration']:
-                    penalty = abs(video['duration'] - self.duration) / self.duration
-                if any(word in title for word in ['cover', 'karaoke', 'live', 'remix', 'instrumental']):
-                    ratio *= 0.8
-                score = ratio - penalty * 0.1
-
-                if bestScore is None or score > bestScore:
-                    backupVid = bestVideo
-                    bestScore = score
-                    bestVideo = video['url']
-
-            if bestVideo is None:
-                bestVideo = videos[0]['url']
-            if backupVid is None and len(videos) > 1:
-                backupVid = videos[1]['url']
-            elif backupVid is None:
-                backupVid = bestVideo
-
-            closestVideo = bestVideo
+            cached = resolution_cache.get(self.uri, 'YouTube') if resolution_cache else MISS
+            if cached is not MISS and cached:
+                closestVideo, backupVid = cached['url'], cached['backup']
+            else:
+                closestVideo, backupVid = self.pick_video(_youtube_search(textToSearch))
+                if resolution_cache is not None:
+                    resolution_cache.put(self.uri, 'YouTube',
+                                         {'url': closestVideo, 'backup': backupVid})
                 
             self.closesturl = closestVideo
             self.backupvid = backupVid
             
             # Try to create pafy object for compatibility
             try:
+                pafy = _load_pafy()
                 if pafy:
                     self.video = pafy.new(closestVideo)
                 else:
@@ -562,20 +1558,139 @@ class Song():
 
         
 
-    def download(self, quiet=False):
-        import subprocess
+    def pick_video(self, videos):
+        """Return the (best, backup) video urls for this song from search results"""
+        # Score videos based on title similarity and duration difference
+        import difflib
+
+        query = (self.name + ' ' + self.artists[0]).lower()
+        bestScore = None
+        bestVideo = None
+        backupVid = None
+
+        for video in videos:
+            title = video['title'].lower()
+            ratio = difflib.SequenceMatcher(None, query, title).ratio()
+            penalty = 0
+            if video['duration']:
+                penalty = abs(video['duration'] - self.duration) / self.duration
+            if any(word in title for word in ['cover', 'karaoke', 'live', 'remix', 'instrumental']):
+                ratio *= 0.8
+            score = ratio - penalty * 0.1
+
+            if bestScore is None or score > bestScore:
+                backupVid = bestVideo
+                bestScore = score
+                bestVideo = video['url']
+
+        if bestVideo is None:
+            bestVideo = videos[0]['url']
+        if backupVid is None and len(videos) > 1:
+            backupVid = videos[1]['url']
+        elif backupVid is None:
+            backupVid = bestVideo
+
+        return bestVideo, backupVid
+
+    def resolve(self, skip=(), quiet=False, race=False):
+        """Find where to download this song from.
+
+        Providers in PROVIDER_ORDER are searched in turn, ignoring any keys in
+        skip, and YouTube is used when none of them has the song. Sets and
+        returns self.source as a (provider key, download target) pair.
+
+        With race=True every provider is searched at once and the best result
+        is used as soon as all higher quality providers have answered or
+        timed out.
+        """
+        if race:
+            return self._resolve_racing(skip, quiet)
+
+        for key in PROVIDER_ORDER:
+            if key in skip:
+                continue
+            if key not in self.resolved:
+                self.resolved[key] = resolve_source(self, PROVIDERS[key], quiet=quiet)
+            target = self.resolved[key]
+            if target:
+                self.source = (key, target)
+                return self.source
+
+        self.get_link(quiet=quiet)
+        self.source = ('youtube', self.closesturl)
+        return self.source
+
+    def _resolve_racing(self, skip, quiet):
+        from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+        pending = [key for key in PROVIDER_ORDER
+                   if key not in skip and key not in self.resolved]
+        executor = ThreadPoolExecutor(max_workers=len(pending) + 1)
+        futures = {key: executor.submit(resolve_source, self, PROVIDERS[key], quiet)
+                   for key in pending}
+        youtube = executor.submit(self.get_link, quiet)
+        # Don't wait for slow resolvers once a result has been chosen
+        executor.shutdown(wait=False)
+
+        deadline = time.monotonic() + RACE_TIMEOUT
+        try:
+            for key in PROVIDER_ORDER:
+                if key in skip:
+                    continue
+                if key in futures:
+                    try:
+                        remaining = max(0, deadline - time.monotonic())
+                        self.resolved[key] = futures[key].result(timeout=remaining)
+                    except TimeoutError:
+                        if not quiet:
+                            print(f"{PROVIDERS[key].name} search timed out for {self.name}")
+                        continue
+                target = self.resolved.get(key)
+                if target:
+                    self.source = (key, target)
+                    return self.source
+
+            youtube.result()
+            self.source = ('youtube', self.closesturl)
+            return self.source
+        finally:
+            # Keep answers that already arrived in case fetching falls back
+            for key, future in futures.items():
+                if future.done() and not future.cancelled():
+                    self.resolved.setdefault(key, future.result())
+                else:
+                    future.cancel()
+            youtube.cancel()
+
+    def fetch(self, quiet=False, transcode=True):
+        """Download the song from self.source.
+
+        If the download fails the next provider is resolved and tried, ending
+        with YouTube. Returns True if a file was downloaded.
+        """
+        if self.source is None:
+            self.resolve(quiet=quiet)
+        failed = set()
+        while True:
+            key, target = self.source
+            if key == 'youtube':
+                return self.download_youtube(quiet=quiet, transcode=transcode)
+            if fetch_source(self, PROVIDERS[key], target, quiet=quiet, transcode=transcode):
+                return True
+            failed.add(key)
+            self.resolve(skip=failed, quiet=quiet)
 
+    def download(self, quiet=False):
         # Try high quality download sources in order
-        if download_from_qobuz(self, quiet=quiet):
-            return
-        if download_from_bandcamp(self, quiet=quiet):
-            return
-        if download_from_soundcloud(self, quiet=quiet):
-            return
-        if download_from_jamendo(self, quiet=quiet):
-            return
+        self.resolve(quiet=quiet)
+        self.fetch(quiet=quiet)
 
-        self.get_link(quiet=quiet)
+    def download_youtube(self, quiet=False, transcode=True):
+        """Download from the YouTube links found by get_link.
+
+        With transcode=False the audio is saved in whatever format YouTube
+        serves instead of being converted to mp3.
+        """
         os.makedirs(self.folder_name, exist_ok=True)
 
         output_path = os.path.join(self.folder_name, self.name_file + ".%(ext)s")
@@ -583,57 +1698,46 @@ class Song():
         
         try:
             # Use yt-dlp to download directly as mp3
-            download_cmd = [
-                'yt-dlp',
-                '--extract-audio',
-                '--audio-format', 'mp3',
-                '--audio-quality', '0',  # best quality
-                '--output', output_path,
-                self.closesturl
-            ]
-            
-            result = subprocess.run(download_cmd, capture_output=True, text=True, timeout=300)
+            audio_format = 'mp3' if transcode else 'best'
             
-            if result.returncode != 0:
+            if not self._fetch_youtube(self.closesturl, output_path, audio_format, quiet):
                 if not quiet:
                     print(f"Primary download failed for {self.name}, trying backup...")
                 # Try backup URL
-                download_cmd[-1] = self.backupvid
-                result = subprocess.run(download_cmd, capture_output=True, text=True, timeout=300)
-                
-                if result.returncode != 0:
-                    raise Exception(f"Both downloads failed: {result.stderr}")
+                if not self._fetch_youtube(self.backupvid, output_path, audio_format, quiet):
+                    raise Exception("Both downloads failed")
             
             # Find the actual downloaded file (yt-dlp might change the extension)
-            for file in os.listdir(self.folder_name):
-                if file.startswith(self.name_file) and file.endswith('.mp3'):
-                    self.file = os.path.join(self.folder_name, file)
-                    break
+            downloaded = find_download(self.folder_name, self.name_file)
+            if transcode and os.path.exists(final_path):
+                self.file = final_path
+            elif transcode and downloaded:
+                # If no mp3 found, rename the file with our name
+                os.rename(downloaded, final_path)
+                self.file = final_path
             else:
-                # If no mp3 found, look for any file with our name and rename it
-                for file in os.listdir(self.folder_name):
-                    if file.startswith(self.name_file):
-                        old_path = os.path.join(self.folder_name, file)
-                        os.rename(old_path, final_path)
-                        self.file = final_path
-                        break
-                else:
-                    self.file = final_path
+                self.file = downloaded or final_path
+            return True
                     
         except Exception as e:
             if not quiet:
                 print(f"yt-dlp failed for {self.name}: {e}")
+            if resolution_cache is not None:
+                # Search again next run rather than retrying videos that failed
+                resolution_cache.forget(self.uri, 'YouTube')
             # Fallback to old method
             try:
-                if self.video and pafy:
-                    self.video.getbestaudio().download(filepath=os.path.join(self.folder_name, self.name_file))
-                    
-                    FNULL = open(os.devnull, 'w')
-                    if not quiet:
-                        print("Converting", self.name)
-                    subprocess.call("ffmpeg -i \"" + os.path.join(self.folder_name, self.name_file)+"\" " + "\""+ final_path +"\"", stdout=FNULL, stderr=subprocess.STDOUT)
-                    os.remove(os.path.join(self.folder_name, self.name_file))
-                    self.file = final_path
+                if self.video and _load_pafy():
+                    stream = self.video.getbestaudio()
+                    raw_path = os.path.join(self.folder_name, self.name_file + '.' + stream.extension)
+                    stream.download(filepath=raw_path)
+                    self.file = raw_path
+                    # The pipeline converts in its transcode stage instead
+                    if transcode:
+                        if not quiet:
+                            print("Converting", self.name)
+                        self.file = adjust_audio_format(raw_path, quiet=quiet)
+                    return True
                 else:
                     raise Exception("No pafy/video object available")
                     
@@ -641,54 +1745,50 @@ class Song():
                 if not quiet:
                     print(f"All download methods failed for {self.name}: {e2}")
                 self.file = None
+                return False
+
+    def _fetch_youtube(self, url, output_path, audio_format, quiet=False):
+        """Download one YouTube video within YOUTUBE_LIMITS, returning True on success"""
+        try:
+            return call_limited(YOUTUBE_LIMITS, 'download', _ytdlp_fetch,
+                                self, url, output_path, audio_format)
+        except Throttled as e:
+            if not quiet:
+                print(f"YouTube is still throttling downloads of {self.name}: {e}")
+            return False
+
+    # start fetching the album cover in the background, shared by the whole album
+    def prefetch_art(self):
+        if self.art_urls and self.art_future is None:
+            self.art_future = _get_art_cache().get_future(
+                self.art_urls[0], _fetch_art, executor=_get_art_executor())
 
-    # download a file from a url | returns file location
+    # fetch the album cover through the art cache | returns image bytes or None
     def download_art(self, quiet=False):
-        # Clean album name for filename
-        clean_album = self.album.replace(':','').replace('?','').replace(';','').replace('<','').replace('>','').replace('*','').replace('|','').replace('/','').replace('\\','').replace('"','').replace("'","'")
-        filename = os.path.join(self.folder_name, clean_album + '.jpg')
-
-        # check if file is already downloaded
-        for file in os.listdir(self.folder_name):
-            if clean_album + '.jpg' == file:
-                return filename
-                
-        if not quiet:
-            print("Downloading Album Art for", self.name)
+        if not self.art_urls:
+            return None
         try:
-            res = requests.get(self.art_urls[0])
-            res.raise_for_status()
-            
-            # Create a safe temporary filename
-            import tempfile
-            temp_filename = os.path.join(self.folder_name, f"temp_art_{hash(self.art_urls[0]) % 10000}.jpg")
-                
-            # Save the file to temp location first
-            with open(temp_filename, 'wb') as file:
-                for chunk in res.iter_content(100000):
-                    file.write(chunk)
-            
-            # Rename to final filename
-            try:
-                if os.path.exists(filename):
-                    os.remove(filename)
-                os.rename(temp_filename, filename)
-            except Exception as e:
-                if not quiet:
-                    print(f"Error renaming art file: {e}")
-                # If rename fails, just use the temp file
-                filename = temp_filename
-                
+            if self.art_future is not None:
+                return self.art_future.result()
+            return _get_art_cache().get(self.art_urls[0], _fetch_art)
         except requests.exceptions.MissingSchema:
             if not quiet:
                 print('Error requests.exceptions.MissingSchema')
         except Exception as e:
             if not quiet:
                 print(f"Error downloading album art: {e}")
+        return None
 
-        return filename
+    # the metadata written to the song's file
+    def file_tags(self, quiet=False, wait_for_art=True):
+        if wait_for_art or (self.art_future is not None and self.art_future.done()):
+            art = self.download_art(quiet=quiet)
+        else:
+            art = None
+        return SongTags(title=self.name, artist=', '.join(self.artists),
+                        album=self.album, uri=self.uri, art=art)
 
-    # assigns id3 attributes to mp3 file
+    # writes tags in the format of the downloaded file (ID3, Vorbis comments or MP4)
     def set_file_attributes(self, quiet=False):
         # Ensure we have the downloaded file path
         if not self.file:
@@ -701,45 +1801,15 @@ class Song():
             return
 
         try:
-            audiofile = eyed3.load(self.file)
-            
-            # Check if eyed3 successfully loaded the file
-            if audiofile is None or audiofile.tag is None:
-                if not quiet:
-                    print(f"Cannot set attributes: {self.file} is not a valid audio file")
-                return
-
-        except TypeError as e:
-            if not quiet:
-                print("Error loading song for setting attributes")
-                print(e)
-            return
-
-        try:
-            try:
-                self.art = self.download_art(quiet=quiet)
-            except FileNotFoundError:
-                if not quiet:
-                    print("Error setting art for", self.name)
-                    print(Exception)
-            audiofile.tag.artist = ', '.join(self.artists)
-            audiofile.tag.album = self.album
-            audiofile.tag.title = self.name
-            audiofile.tag.publisher = self.uri
-            try:
-                audiofile.tag.images.set(3, open(self.art,'rb').read(), 'image/jpeg')
-            except:
-                pass
-            audiofile.tag.save(self.file)
-
-        except AttributeError as e:
+            if write_tags(self.file, self.file_tags(quiet=quiet)):
+                self.tagged = True
+            elif not quiet:
+                print(f"Cannot set attributes: {self.file} is not a taggable audio file")
+        except Exception as e:
             if not quiet:
                 print("Error setting file attributes")
                 print(e)
 
-        except UnboundLocalError:
-            pass
-
 # Example of how to add a new provider:
 # def _resolve_newsite_url(query):
 #     """Find NewSite URL for a search query"""
@@ -764,7 +1834,7 @@ def _resolve_freesound_url(query):
     try:
         # Freesound API search
         api_url = f"https://freesound.org/apiv2/search/text/?query={urllib.parse.quote(query)}&token={api_key}&format=json&fields=id,name,previews"
-        res = requests.get(api_url, timeout=15)
+        res = http_get(api_url, timeout=15)
         res.raise_for_status()
         data = res.json()
         
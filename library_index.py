@@ -0,0 +1,455 @@
+"""Persistent index of downloaded songs keyed by Spotify URI.
+
+Reading the URI tag of every file in the library on each run is slow for
+large collections, so the index remembers the URI found in each file along
+with the file's size, mtime and inode. Refreshing the index only stats the
+files on disk and re-reads the tags of files that are new or have changed.
+
+Tags are read by a thread pool with read_tag_uri(), which parses just enough
+of the file to find the URI (the ID3v2 TPUB frame of an mp3, the Vorbis
+comment block of a FLAC or the ilst atom of an m4a) instead of loading the
+whole tag.
+"""
+
+import json
+import os
+import sqlite3
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader_functions import getUri
+from tagging import TAGGED_EXTENSIONS
+
+INDEX_FILE = 'library_index.db'
+
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Returned by the fast readers for tags they cannot parse
+UNKNOWN = object()
+
+_TEXT_ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _decode_text_frame(data):
+    if not data:
+        return None
+    encoding = _TEXT_ENCODINGS.get(data[0])
+    if encoding is None:
+        return UNKNOWN
+    text = data[1:].decode(encoding, errors='replace')
+    # ID3v2.4 separates multiple values with NUL; eyed3 reports the first
+    text = text.split('\x00')[0]
+    return text or None
+
+
+def read_publisher(file_path):
+    """Return the publisher (TPUB) frame of an mp3's ID3v2 tag.
+
+    Only the tag header and the frame headers before TPUB are read. Returns
+    None if the file has no tag or no publisher frame, and UNKNOWN for tags
+    using features this reader does not handle (unsynchronisation,
+    compressed or encrypted frames), which should be read with getUri().
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b'ID3':
+            return None
+        version, flags = header[3], header[5]
+        if version not in (2, 3, 4):
+            return UNKNOWN
+        if flags & 0x80:
+            return UNKNOWN
+        tag = f.read(_syncsafe(header[6:10]))
+
+    pos = 0
+    if flags & 0x40 and version in (3, 4):
+        if len(tag) < 4:
+            return None
+        if version == 3:
+            pos = 4 + struct.unpack('>I', tag[:4])[0]
+        else:
+            pos = _syncsafe(tag[:4])
+
+    if version == 2:
+        id_len, header_len, wanted = 3, 6, b'TPB'
+    else:
+        id_len, header_len, wanted = 4, 10, b'TPUB'
+
+    while pos + header_len <= len(tag):
+        frame_id = tag[pos:pos + id_len]
+        if frame_id[0] == 0:
+            break  # padding
+        if version == 2:
+            size = int.from_bytes(tag[pos + 3:pos + 6], 'big')
+            frame_flags = 0
+        elif version == 3:
+            size = struct.unpack('>I', tag[pos + 4:pos + 8])[0]
+            frame_flags = struct.unpack('>H', tag[pos + 8:pos + 10])[0] & 0x00e0
+        else:
+            size = _syncsafe(tag[pos + 4:pos + 8])
+            frame_flags = struct.unpack('>H', tag[pos + 8:pos + 10])[0] & 0x004f
+        start = pos + header_len
+        if frame_id == wanted:
+            if frame_flags:
+                return UNKNOWN
+            return _decode_text_frame(tag[start:start + size])
+        pos = start + size
+    return None
+
+
+def read_vorbis_publisher(file_path):
+    """Return the PUBLISHER comment of a FLAC file.
+
+    Metadata blocks before the Vorbis comment block, such as embedded
+    pictures, are skipped without being read.
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+        if magic[:3] == b'ID3':
+            return UNKNOWN
+        if magic != b'fLaC':
+            return None
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return None
+            block_type, size = header[0] & 0x7f, int.from_bytes(header[1:4], 'big')
+            if block_type == 4:
+                block = f.read(size)
+                break
+            if header[0] & 0x80:
+                return None  # last block and no comments
+            f.seek(size, os.SEEK_CUR)
+
+    vendor_length = struct.unpack_from('<I', block, 0)[0]
+    pos = 4 + vendor_length
+    count = struct.unpack_from('<I', block, pos)[0]
+    pos += 4
+    for _ in range(count):
+        length = struct.unpack_from('<I', block, pos)[0]
+        comment = block[pos + 4:pos + 4 + length].decode('utf-8', errors='replace')
+        pos += 4 + length
+        key, _, value = comment.partition('=')
+        if key.upper() == 'PUBLISHER':
+            return value or None
+    return None
+
+
+def _mp4_atoms(f, start, stop):
+    """Yield (type, body start, body end) for the atoms between start and stop."""
+    pos = start
+    while pos + 8 <= stop:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = stop - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, stop)
+        pos += size
+
+
+def _mp4_child(f, start, stop, wanted):
+    for kind, body_start, body_end in _mp4_atoms(f, start, stop):
+        if kind == wanted:
+            return body_start, body_end
+    return None
+
+
+def read_mp4_publisher(file_path):
+    """Return the ----:com.apple.iTunes:PUBLISHER atom of an m4a file.
+
+    Only atom headers are read on the way to moov/udta/meta/ilst, so the
+    audio data is never touched.
+    """
+    with open(file_path, 'rb') as f:
+        span = (0, os.fstat(f.fileno()).st_size)
+        for name in (b'moov', b'udta', b'meta', b'ilst'):
+            span = _mp4_child(f, span[0], span[1], name)
+            if span is None:
+                return None
+            if name == b'meta':
+                span = (span[0] + 4, span[1])  # version and flags
+        for kind, start, end in _mp4_atoms(f, *span):
+            if kind != b'----':
+                continue
+            fields = {}
+            for child, child_start, child_end in _mp4_atoms(f, start, end):
+                f.seek(child_start)
+                fields[child] = f.read(child_end - child_start)
+            # mean and name carry 4 bytes of flags, data 4 bytes of type and 4 of locale
+            if (fields.get(b'mean', b'')[4:] == b'com.apple.iTunes'
+                    and fields.get(b'name', b'')[4:] == b'PUBLISHER'
+                    and b'data' in fields):
+                return fields[b'data'][8:].decode('utf-8', errors='replace') or None
+    return None
+
+
+_FAST_READERS = {
+    '.mp3': read_publisher,
+    '.flac': read_vorbis_publisher,
+    '.m4a': read_mp4_publisher,
+}
+
+
+def read_tag_uri(file_path):
+    """Return the URI tag of a file with the fast reader for its format.
+
+    Returns None for files without one and UNKNOWN if the tag couldn't be
+    parsed this way.
+    """
+    reader = _FAST_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        return None
+    try:
+        return reader(file_path)
+    except (struct.error, ValueError):
+        return UNKNOWN
+
+
+def readUri(file_path):
+    """Return the URI stored in a library file, or None.
+
+    Uses read_tag_uri() and falls back to a full tag parse for tags it
+    cannot handle. Files that cannot carry a URI tag are not opened.
+    """
+    if not file_path.lower().endswith(TAGGED_EXTENSIONS):
+        return None
+    try:
+        uri = read_tag_uri(file_path)
+    except OSError:
+        return None
+    if uri is UNKNOWN:
+        return getUri(file_path)
+    return uri
+
+
+def library_roots(folder_name):
+    """Return the folders that make up the library for a playlist run.
+
+    This is the playlist folder plus every other visible top-level folder in
+    the current directory, matching the folders checked for duplicates.
+    """
+    roots = [folder_name]
+    for folder in os.listdir():
+        if folder == folder_name or folder.startswith('.'):
+            continue
+        if os.path.isdir(folder):
+            roots.append(folder)
+    return roots
+
+
+def _is_under(path, root):
+    """Return True if path is root or lies inside it."""
+    root = os.path.normpath(root)
+    return path == root or path.startswith(root + os.sep)
+
+
+class LibraryIndex:
+    """SQLite backed mapping of library files to their Spotify URIs.
+
+    The table is loaded once into two dicts, path -> URI and URI -> paths,
+    which answer every lookup during a run and are kept up to date by add()
+    and remove().
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.by_path = None
+        self.by_uri = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, uri TEXT, size INTEGER, '
+                'mtime REAL, inode INTEGER)'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS files_uri ON files (uri)'
+            )
+
+    def refresh(self, roots, quiet=False, workers=SCAN_WORKERS):
+        """Bring the index up to date with the files under roots.
+
+        Files whose size, mtime and inode match the stored entry keep their
+        cached URI; only new or changed files have their tags read, using
+        up to workers threads. Entries for files that no longer exist under
+        any root are removed.
+        """
+        with self.lock:
+            known = {
+                row[0]: row[1:]
+                for row in self.conn.execute(
+                    'SELECT path, size, mtime, inode FROM files'
+                )
+            }
+
+        seen = set()
+        changed = []
+        for root in roots:
+            for dirpath, _, files in os.walk(root):
+                for file in files:
+                    file_path = os.path.normpath(os.path.join(dirpath, file))
+                    try:
+                        st = os.stat(file_path)
+                    except OSError:
+                        continue
+                    seen.add(file_path)
+                    stat_key = (st.st_size, st.st_mtime, st.st_ino)
+                    if known.get(file_path) != stat_key:
+                        changed.append((file_path, stat_key))
+
+        paths = [file_path for file_path, _ in changed]
+        if workers > 1 and len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                uris = list(executor.map(readUri, paths))
+        else:
+            uris = [readUri(file_path) for file_path in paths]
+        rows = [
+            (file_path, uri, size, mtime, inode)
+            for (file_path, (size, mtime, inode)), uri in zip(changed, uris)
+        ]
+
+        stale = [(p,) for p in known if p not in seen]
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO files (path, uri, size, mtime, inode) '
+                'VALUES (?, ?, ?, ?, ?)', rows
+            )
+            self.conn.executemany('DELETE FROM files WHERE path = ?', stale)
+
+        if not quiet and (rows or stale):
+            print(f"Library index: {len(rows)} updated, {len(stale)} removed")
+        self._load()
+
+    def _load(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT path, uri FROM files').fetchall()
+            self.by_path = {}
+            self.by_uri = {}
+            for path, uri in rows:
+                self._remember(path, uri)
+
+    def _remember(self, path, uri):
+        self.by_path[path] = uri
+        if uri:
+            self.by_uri.setdefault(uri, set()).add(path)
+
+    def _forget(self, path):
+        uri = self.by_path.pop(path, None)
+        paths = self.by_uri.get(uri)
+        if paths is not None:
+            paths.discard(path)
+            if not paths:
+                del self.by_uri[uri]
+
+    def _ensure_loaded(self):
+        if self.by_path is None:
+            self._load()
+
+    def files(self, root=None):
+        """Return (path, uri) pairs for indexed files, optionally under root."""
+        self._ensure_loaded()
+        with self.lock:
+            rows = list(self.by_path.items())
+        if root is None:
+            return rows
+        return [(path, uri) for path, uri in rows if _is_under(path, root)]
+
+    def uris(self, root=None):
+        """Return the set of URIs in the library, optionally under root."""
+        self._ensure_loaded()
+        if root is None:
+            with self.lock:
+                return set(self.by_uri)
+        return {uri for _, uri in self.files(root) if uri}
+
+    def paths(self, uri, root=None):
+        """Return the indexed files tagged with uri, optionally only under root."""
+        self._ensure_loaded()
+        with self.lock:
+            paths = list(self.by_uri.get(uri, ()))
+        if root is None:
+            return paths
+        return [path for path in paths if _is_under(path, root)]
+
+    def add(self, file_path, uri):
+        """Record a file that was just written with the given URI."""
+        file_path = os.path.normpath(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return
+        self._ensure_loaded()
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files (path, uri, size, mtime, inode) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (file_path, uri, st.st_size, st.st_mtime, st.st_ino)
+            )
+            self._forget(file_path)
+            self._remember(file_path, uri)
+
+    def remove(self, file_path):
+        """Forget a file that has been deleted from the library."""
+        file_path = os.path.normpath(file_path)
+        self._ensure_loaded()
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (file_path,))
+            self._forget(file_path)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class PlaylistSnapshots:
+    """The snapshot_id and track listing of each playlist at its last sync.
+
+    Stored in the same SQLite file as the library index.
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS playlists ('
+                'id TEXT PRIMARY KEY, snapshot_id TEXT, name TEXT, tracks TEXT)'
+            )
+
+    def get(self, playlist_id):
+        """Return a dict with snapshot_id, name and tracks, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT snapshot_id, name, tracks FROM playlists WHERE id = ?',
+                (playlist_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'snapshot_id': row[0], 'name': row[1], 'tracks': json.loads(row[2])}
+
+    def put(self, playlist_id, snapshot_id, name, tracks):
+        """Record the listing of a playlist that was fully synced."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO playlists (id, snapshot_id, name, tracks) '
+                'VALUES (?, ?, ?, ?)',
+                (playlist_id, snapshot_id, name, json.dumps(tracks))
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,265 @@
+"""Worker pools used to schedule song downloads."""
+
+import os
+import queue
+import sys
+import threading
+import traceback
+
+from downloader_functions import adjust_audio_format, tagSong
+
+DEFAULT_WORKERS = 5
+
+
+def physical_cores():
+    """Return the number of physical CPU cores, falling back to logical CPUs.
+
+    Transcoding gains little from hyper-threads, so the transcode stage is
+    sized from this rather than os.cpu_count().
+    """
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    except ImportError:
+        pass
+    try:
+        cores = set()
+        physical_id = None
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'physical id':
+                    physical_id = value.strip()
+                elif key == 'core id':
+                    cores.add((physical_id, value.strip()))
+        if cores:
+            return len(cores)
+    except OSError:
+        pass
+    return os.cpu_count() or 1
+
+
+class WorkerPool:
+    """A fixed number of worker threads consuming a bounded work queue.
+
+    Items passed to submit() are handed to handler() by the first free
+    worker. submit() blocks while the queue is full so producers never run
+    far ahead of the workers.
+    """
+
+    def __init__(self, handler, workers=DEFAULT_WORKERS, maxsize=None, name='worker'):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=workers * 2 if maxsize is None else maxsize)
+        self.closed = threading.Event()
+        self.cancelled = threading.Event()
+        self.active = 0
+        self.active_lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=0.2)
+            except queue.Empty:
+                if self.closed.is_set():
+                    return
+                continue
+            try:
+                if self.cancelled.is_set():
+                    continue
+                with self.active_lock:
+                    self.active += 1
+                try:
+                    self.handler(item)
+                except Exception:
+                    print(f"Unhandled error in {threading.current_thread().name}:",
+                          file=sys.stderr)
+                    traceback.print_exc()
+                finally:
+                    with self.active_lock:
+                        self.active -= 1
+            finally:
+                self.queue.task_done()
+
+    def submit(self, item):
+        """Queue an item for processing. Returns False if the pool was cancelled."""
+        # Poll with a timeout so Ctrl-C is delivered while blocked on a full queue
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def backlog(self):
+        """Return the number of items queued or being processed."""
+        with self.active_lock:
+            return self.queue.qsize() + self.active
+
+    def close(self):
+        """Signal that no more work is coming; workers exit once the queue drains."""
+        self.closed.set()
+
+    def cancel(self):
+        """Drop all queued work. Items already being processed run to completion."""
+        self.cancelled.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+
+    def join(self):
+        """Wait for every worker thread to exit."""
+        for t in self.threads:
+            while t.is_alive():
+                t.join(0.5)
+
+
+def run_pool(pool, items, log=print):
+    """Feed items to pool and wait for them to finish.
+
+    On Ctrl-C the remaining items are dropped and the songs already being
+    downloaded are allowed to finish. A second Ctrl-C aborts immediately.
+    Returns True if every item was processed, False if interrupted.
+    """
+    try:
+        for item in items:
+            pool.submit(item)
+        pool.close()
+        pool.join()
+        return True
+    except KeyboardInterrupt:
+        log("Interrupted, waiting for current downloads to finish (Ctrl-C again to abort)...")
+        pool.cancel()
+        pool.close()
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            pass
+        return False
+
+
+class DownloadPipeline:
+    """Downloads songs through separate resolve, fetch, transcode and tag stages.
+
+    Each stage has its own bounded queue and worker pool, so network bound
+    work (searching providers and fetching audio) does not compete with CPU
+    bound work (ffmpeg conversion and tagging) for the same threads. When a
+    stage falls behind its queue fills up and the stage feeding it blocks.
+
+    The transcode and tag stages default to one worker per physical core,
+    and each ffmpeg job is limited to its share of the logical CPUs so that
+    concurrent conversions don't oversubscribe the machine.
+
+    With race=True each song's providers are searched concurrently, see
+    Song.resolve().
+
+    The pipeline has the same submit/close/join/cancel interface as
+    WorkerPool so it can be driven by run_pool().
+    """
+
+    def __init__(self, network_workers=DEFAULT_WORKERS, cpu_workers=None,
+                 on_start=None, on_done=None, race=False, quiet=True):
+        cpu_workers = cpu_workers or physical_cores()
+        self.ffmpeg_threads = max(1, (os.cpu_count() or 1) // cpu_workers)
+        self.race = race
+        self.on_start = on_start
+        self.on_done = on_done
+        self.quiet = quiet
+        self.resolve = self._stage(self._resolve, network_workers, 'resolve')
+        self.fetch = self._stage(self._fetch, network_workers, 'fetch')
+        self.transcode = self._stage(self._transcode, cpu_workers, 'transcode')
+        self.tag = self._stage(self._tag, cpu_workers, 'tag')
+        self.stages = [self.resolve, self.fetch, self.transcode, self.tag]
+
+    def _stage(self, handler, workers, name):
+        def run(song):
+            try:
+                next_stage = handler(song)
+            except Exception as e:
+                if not self.quiet:
+                    print(f"{name} failed for {song.name}: {e}")
+                next_stage = None
+            if next_stage is None or not next_stage.submit(song):
+                self._finish(song)
+        return WorkerPool(run, workers=workers, name=name)
+
+    def _finish(self, song):
+        # Songs that failed before the tag stage still hold their prefetched cover
+        song.art_future = None
+        if self.on_done:
+            self.on_done(song)
+
+    def _resolve(self, song):
+        if self.on_start:
+            self.on_start(song)
+        song.resolve(quiet=self.quiet, race=self.race)
+        return self.fetch
+
+    def _fetch(self, song):
+        if song.fetch(quiet=self.quiet, transcode=False) and song.file and os.path.exists(song.file):
+            return self.transcode
+        if not self.quiet:
+            print(f"Failed to download {song.name}")
+        return None
+
+    def _transcode(self, song):
+        # Tag while converting if the cover is already here, see adjust_audio_format()
+        tags = song.file_tags(quiet=self.quiet, wait_for_art=False)
+        song.file = adjust_audio_format(song.file, quiet=self.quiet,
+                                        threads=self.ffmpeg_threads, tags=tags)
+        song.tagged = tags.written
+        return self.tag
+
+    def _tag(self, song):
+        tagSong(song, quiet=self.quiet)
+        return None
+
+    def backlog(self, stage):
+        """Return the number of songs waiting in or being processed by a stage."""
+        return getattr(self, stage).backlog()
+
+    def submit(self, song):
+        """Queue a song, blocking while the resolve stage is full.
+
+        The song's album cover starts downloading once it is queued so that
+        it is ready by the time the tag stage needs it.
+        """
+        if not self.resolve.submit(song):
+            return False
+        song.prefetch_art()
+        return True
+
+    def close(self):
+        """Signal that no more songs are coming."""
+        self.resolve.close()
+
+    def cancel(self):
+        """Drop the songs waiting to be searched for or downloaded.
+
+        Songs that have already been downloaded still go through the
+        transcode and tag stages, so an interrupted run never leaves
+        unconverted or untagged files in the library.
+        """
+        self.resolve.cancel()
+        self.fetch.cancel()
+
+    def join(self):
+        """Wait for every stage to drain, closing each once its input is done."""
+        for i, stage in enumerate(self.stages):
+            stage.join()
+            if i + 1 < len(self.stages):
+                self.stages[i + 1].close()
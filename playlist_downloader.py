@@ -1,33 +1,73 @@
 import spotipy
 import os
-os.environ.setdefault('PAFY_BACKEND', 'internal')
 import urllib
-import pafy
 import shelve
 import threading
 import sys
 import argparse
-import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+import time
+from itertools import chain
 from tqdm import tqdm
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 from downloader_functions import *
-from bs4 import BeautifulSoup
+from library_index import LibraryIndex, PlaylistSnapshots, library_roots
+from resolution_cache import ResolutionCache
+from pipeline import DEFAULT_WORKERS, DownloadPipeline, physical_cores, run_pool
 
-parser = argparse.ArgumentParser(description="Download songs from a Spotify playlist")
-parser.add_argument("playlist_url", help="Spotify playlist URL or URI")
+parser = argparse.ArgumentParser(description="Download songs from Spotify playlists")
+parser.add_argument("playlist_urls", nargs="*", metavar="playlist_url",
+                    help="Spotify playlist URLs or URIs")
+parser.add_argument("--file", "-f", action="append", default=[],
+                    help="Read playlist URLs from a file, one per line")
 parser.add_argument("--limit", "-l", type=int, help="Only download the first N songs", default=None)
 parser.add_argument("--user-auth", action="store_true",
                     help="Authenticate via web browser instead of client credentials")
+parser.add_argument("--workers", "-w", type=int, default=DEFAULT_WORKERS,
+                    help=f"Number of songs to search for and download at once (default: {DEFAULT_WORKERS})")
+parser.add_argument("--transcode-workers", type=int, default=None,
+                    help="Number of songs to convert with ffmpeg at once (default: one per physical CPU core)")
+parser.add_argument("--segments", type=int, default=DOWNLOAD_SEGMENTS,
+                    help=f"Connections used for each large direct download, 1 to disable (default: {DOWNLOAD_SEGMENTS})")
+parser.add_argument("--no-cache", action="store_true",
+                    help="Search every provider again instead of reusing earlier results")
+parser.add_argument("--race", action="store_true",
+                    help="Search all providers at once instead of one after another")
 args = parser.parse_args()
 
+# Time spent in each phase of the run, printed at the end
+phase_times = []
+phase_start = time.perf_counter()
+
+def end_phase(name):
+    global phase_start
+    now = time.perf_counter()
+    phase_times.append((name, now - phase_start))
+    phase_start = now
+
+def print_timings():
+    print("Timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in phase_times))
+
+playlist_urls = list(args.playlist_urls)
+for path in args.file:
+    with open(path) as url_file:
+        for line in url_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                playlist_urls.append(line)
+if not playlist_urls:
+    parser.error("give at least one playlist URL or --file")
+
 shelveFile = shelve.open('spotify_data')
 
 client_id = shelveFile.get('SPOTIPY_CLIENT_ID', os.environ.get('SPOTIPY_CLIENT_ID'))
 client_secret = shelveFile.get('SPOTIPY_CLIENT_SECRET', os.environ.get('SPOTIPY_CLIENT_SECRET'))
 
 if args.user_auth:
+    # Only needed for the browser login
+    import webbrowser
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
     if not client_id:
         client_id = input("Enter Client ID: ")
         shelveFile['SPOTIPY_CLIENT_ID'] = client_id
@@ -122,72 +162,143 @@ else:
         sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
 
 shelveFile.close()
+end_phase("auth")
 
 #TEMP Test Link
 #test_link = "https://open.spotify.com/user/sparks_of_fire/playlist/4ScHDVxjzDpBFOyyKdWw6G?si=R_AFDhOJTYymeBpjs96jhw"
 
-#set variables
-threadList = []  # stores all threads
-downloadQueue = []  # songs to be downloaded
-
-playlist_url = args.playlist_url
 limit = args.limit
 
-songs, folder_name = getTracks(playlist_url, sp, limit=limit)
-os.makedirs(folder_name, exist_ok=True)
+# Messages go through the progress bar once it exists
+log = print
+
+# The first playlist's pages start downloading in the background here
+snapshots = PlaylistSnapshots()
+first_sync = syncTracks(playlist_urls[0], sp, snapshots, limit=limit)
+os.makedirs(first_sync.name, exist_ok=True)
+end_phase("playlist")
 
 print("Checking already downloaded songs...")
-# get URIs of downloaded songs
-URIs = []
-playlistFolderURIs = []
-for root, _, files in os.walk(folder_name):
-    for file in files:
-        file_path = os.path.join(root, file)
-        if os.path.isfile(file_path):
-            playlistFolderURIs.append(getUri(file_path))
+# get URIs of downloaded songs from the persistent library index
+library = LibraryIndex()
+library.refresh(library_roots(first_sync.name))
+end_phase("library index")
 
+#Don't download dupe songs from other folders. Songs are added once queued
+#so a song in several playlists is only downloaded once.
+URIs = library.uris()
 
-#Don't download dupe songs from other folders
-URIs.extend(playlistFolderURIs)
+# PlaylistSync of each playlist processed
+playlist_runs = []
+# Playlists whose pages stopped arriving part way through
+failed_syncs = []
 
-for folder in os.listdir():
-    if folder == folder_name or folder.startswith('.'):
-        continue
-    if not os.path.isdir(folder):
+def playlist_syncs():
+    yield first_sync
+    for playlist_url in playlist_urls[1:]:
+        try:
+            sync = syncTracks(playlist_url, sp, snapshots, limit=limit)
+        except Exception as e:
+            log(f"Skipping {playlist_url}: {e}")
+            continue
+        os.makedirs(sync.name, exist_ok=True)
+        yield sync
+
+def new_songs(sync):
+    """Return an iterator over sync's songs if any of them isn't in the library, else None.
+
+    The playlist is streamed until its first new song, so a playlist with
+    songs to download starts downloading as its pages arrive.
+    """
+    songs = sync.stream()
+    seen = []
+    for song in songs:
+        seen.append(song)
+        if song.uri not in URIs:
+            return chain(seen, songs)
+    return None
+
+def delete_removed(syncs, failed=()):
+    """Delete songs removed from the playlists and save their snapshots.
+
+    Nothing is deleted from the failed playlists and their snapshots aren't
+    saved, but the songs they had at their last sync are kept elsewhere.
+    """
+    # Songs removed from one playlist may still be wanted by another in this run
+    wantedURIs = {song.uri for sync in chain(syncs, failed) for song in sync.songs}
+    for sync in failed:
+        wantedURIs.update(track['uri'] for track in sync.previous or ())
+
+    print("Deleting Removed Songs")
+    for sync in syncs:
+        if sync.added is not None and not sync.unchanged:
+            print(f"{sync.name}: {len(sync.added)} songs added and {len(sync.removed)} removed since last sync")
+        # Compared with the index on every run, even for unchanged playlists, so
+        # a song kept because another playlist wanted it is deleted once none does
+        delRemoved(library.uris(sync.name) - wantedURIs, sync.songs, sync.name, library=library)
+        saveSnapshot(sync, snapshots)
+
+# Playlists whose songs are all in the library need nothing downloaded, only
+# removed songs deleted. Check them before setting up any downloading; the
+# first playlist with a new song switches to the full run.
+remaining_syncs = playlist_syncs()
+up_to_date = []
+needs_work = None
+needs_work_songs = None
+for sync in remaining_syncs:
+    try:
+        needs_work_songs = new_songs(sync)
+    except Exception as e:
+        log(f"Skipping {sync.name}: {e}")
+        failed_syncs.append(sync)
         continue
-    for root, _, files in os.walk(folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if os.path.isfile(file_path):
-                URIs.append(getUri(file_path))
-
-for song in songs:
-    if song.uri in URIs:
-        pass  # Skip already downloaded songs silently
-    else:
-        downloadQueue.append(song)
-
-
-# Progress bar for all songs (downloaded + to download)
-progress_bar = tqdm(total=len(songs), desc="Processing Songs", unit="song", 
-                   bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]')
-
-# Update progress for already downloaded songs (without affecting rate calculation)
-already_downloaded = len(songs) - len(downloadQueue)
-if already_downloaded > 0:
-    # Set initial progress without starting the timer
-    progress_bar.n = already_downloaded
-    progress_bar.refresh()
+    if needs_work_songs is not None:
+        needs_work = sync
+        break
+    up_to_date.append(sync)
+end_phase("diff")
+
+if needs_work is None:
+    for sync in up_to_date:
+        print(f"{sync.name}: up to date ({sync.total} songs)")
+    delete_removed(up_to_date, failed_syncs)
+    snapshots.close()
+    library.close()
+    end_phase("cleanup")
+    print("Nothing to download")
+    print_timings()
+    sys.exit(0)
+
+# The resolve and fetch stages each run args.workers network threads
+configure_http(pool_size=args.workers * max(2, args.segments), segments=args.segments)
+
+if not args.no_cache:
+    set_resolution_cache(ResolutionCache())
+
+# Progress bar for all songs (downloaded + to download), grows as playlists are read
+progress_bar = tqdm(total=0, desc="Processing Songs", unit="song", 
+                   bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}{postfix}]')
+log = progress_bar.write
 
 # Flag to track when downloads actually start
 downloads_started = False
 
 # Track currently downloading songs
-import threading
 downloading_lock = threading.Lock()
 currently_downloading = []
+download_status = ""
 
-def thread_download(song):
+def update_postfix():
+    """Show the transcode backlog and the progress of the current download."""
+    parts = []
+    waiting = pipeline.backlog('transcode')
+    if waiting:
+        parts.append(f"transcoding: {waiting}")
+    if download_status:
+        parts.append(download_status)
+    progress_bar.set_postfix_str(" | ".join(parts))
+
+def start_download(song):
     global downloads_started
     
     with downloading_lock:
@@ -202,14 +313,19 @@ def thread_download(song):
         if not downloads_started:
             downloads_started = True
             progress_bar.start_t = progress_bar._time()
-    
-    downloadSong(song, quiet=True)
 
-
-    
+def finish_download(song):
+    global download_status
+    # Saves the next run reading the new file's tags
+    if song.tagged:
+        library.add(song.file, song.uri)
     with downloading_lock:
-        currently_downloading.remove(song.name)
+        if song.name in currently_downloading:
+            currently_downloading.remove(song.name)
+        if not currently_downloading:
+            download_status = ""
         progress_bar.update(1)
+        update_postfix()
         # Update description after completion
         if currently_downloading:
             current_desc = f"Downloading: {', '.join(currently_downloading[:3])}"
@@ -219,27 +335,64 @@ def thread_download(song):
         else:
             progress_bar.set_description("Processing Songs")
 
-#While there are songs in download queue download songs
-while len(downloadQueue) > 0:
-    if len(threadList) <= 4:
-        threadObj = threading.Thread(target=thread_download, args=[downloadQueue.pop(0)])
-        threadObj.handled = False
-        threadList.append(threadObj)
-        threadObj.start()
-
-    for t in threadList:
-        if not t.is_alive():
-            #print("Thread Done")
-            t.handled = True
-    threadList = [t for t in threadList if not t.handled]
-
-#Wait for all thread to finish
-for t in threadList:
-    t.join()
-
-progress_bar.set_description("Finalizing...")
+def skip_downloaded(song):
+    # Count already downloaded songs without affecting rate calculation
+    with downloading_lock:
+        progress_bar.n += 1
+        progress_bar.refresh()
+
+def queue_new_songs():
+    """Yield songs that need downloading as the playlist pages arrive."""
+    for sync in chain(up_to_date, [needs_work], remaining_syncs):
+        if sync.unchanged:
+            progress_bar.write(f"{sync.name}: unchanged since last sync")
+        with downloading_lock:
+            progress_bar.total += sync.total
+            progress_bar.refresh()
+
+        try:
+            for song in needs_work_songs if sync is needs_work else sync.stream():
+                if song.uri in URIs:
+                    skip_downloaded(song)  # Skip already downloaded songs silently
+                else:
+                    URIs.add(song.uri)
+                    yield song
+        except Exception as e:
+            # Songs already queued still download
+            log(f"Skipping the rest of {sync.name}: {e}")
+            failed_syncs.append(sync)
+            with downloading_lock:
+                progress_bar.total -= sync.total - len(sync.songs)
+                progress_bar.refresh()
+        else:
+            playlist_runs.append(sync)
+
+def show_download_progress(song, downloaded, total):
+    global download_status
+    if total:
+        download_status = f"{song.name}: {downloaded * 100 // total}%"
+        update_postfix()
+
+set_download_progress_hook(show_download_progress)
+
+#Download queued songs through the resolve/fetch/transcode/tag pipeline
+pipeline = DownloadPipeline(network_workers=args.workers,
+                            cpu_workers=args.transcode_workers or physical_cores(),
+                            race=args.race, on_start=start_download, on_done=finish_download)
+completed = run_pool(pipeline, queue_new_songs(), log=progress_bar.write)
+end_phase("download")
+
+progress_bar.set_description("Finalizing..." if completed else "Interrupted")
 progress_bar.close()
 
-print("Deleting Removed Songs")
-delRemoved(playlistFolderURIs, songs, folder_name)
+if not completed:
+    library.close()
+    snapshots.close()
+    sys.exit(130)
+
+delete_removed(playlist_runs, failed_syncs)
+snapshots.close()
+library.close()
+end_phase("cleanup")
 print("Done")
+print_timings()
@@ -0,0 +1,102 @@
+"""Per-provider request rate limits and adaptive concurrency.
+
+Each provider gets a token bucket limiting how many requests start per
+second and an AIMD (additive increase, multiplicative decrease) limit on how
+many run at once. The concurrency limit creeps up while requests succeed and
+is halved when the provider starts throttling, so workers settle at the rate
+the provider tolerates instead of hammering it into refusing requests.
+"""
+
+import threading
+import time
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class Throttled(Exception):
+    """A provider refused a request because too many were made."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts of up to burst."""
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may start."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit adjusted with AIMD from request outcomes.
+
+    Starts at half of maximum. Each successful request adds 1/limit, so the
+    limit grows by about one per round of requests; a throttled request
+    halves it, at most once per cooldown seconds so that a burst of
+    failures from requests already in flight only counts once.
+    """
+
+    def __init__(self, maximum=DEFAULT_MAX_CONCURRENCY, minimum=1, cooldown=5.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = max(self.minimum, self.maximum / 2)
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Block until fewer than limit requests are in flight."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False, succeeded=True):
+        """Finish a request. Unsuccessful requests that weren't throttled don't change the limit."""
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class ProviderLimiter:
+    """The rate and concurrency limits applied to one kind of request to a provider."""
+
+    def __init__(self, rate_limit=None, burst=1, max_concurrency=None):
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.concurrency = AdaptiveLimiter(max_concurrency or DEFAULT_MAX_CONCURRENCY)
+
+    def acquire(self):
+        self.concurrency.acquire()
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def release(self, throttled=False, succeeded=True):
+        self.concurrency.release(throttled=throttled, succeeded=succeeded)
@@ -0,0 +1,74 @@
+"""On-disk cache of provider search results keyed by Spotify URI.
+
+Searching Qobuz, Bandcamp, SoundCloud, Jamendo and YouTube for every track
+that still needs downloading is the slowest part of a re-run after a partial
+failure. The cache remembers what each provider returned for a track,
+including when it found nothing, so later runs can skip straight to
+fetching. Entries expire so that new uploads are eventually picked up.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = 'resolution_cache.db'
+
+# How long results are trusted, in seconds
+FOUND_TTL = 30 * 24 * 60 * 60
+NOT_FOUND_TTL = 24 * 60 * 60
+
+# Returned by get() when there is no usable entry
+MISS = object()
+
+
+class ResolutionCache:
+    """SQLite backed store of (URI, provider) -> search result."""
+
+    def __init__(self, path=CACHE_FILE, found_ttl=FOUND_TTL, not_found_ttl=NOT_FOUND_TTL):
+        self.path = path
+        self.found_ttl = found_ttl
+        self.not_found_ttl = not_found_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'uri TEXT, provider TEXT, value TEXT, expires REAL, '
+                'PRIMARY KEY (uri, provider))'
+            )
+            self.conn.execute('DELETE FROM results WHERE expires < ?', (time.time(),))
+
+    def get(self, uri, provider):
+        """Return the cached result, None for a cached miss, or MISS."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT value, expires FROM results WHERE uri = ? AND provider = ?',
+                (uri, provider)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return MISS
+        return json.loads(row[0])
+
+    def put(self, uri, provider, value):
+        """Store a search result. None records that nothing was found."""
+        ttl = self.not_found_ttl if value is None else self.found_ttl
+        try:
+            encoded = json.dumps(value)
+        except (TypeError, ValueError):
+            return
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO results (uri, provider, value, expires) '
+                'VALUES (?, ?, ?, ?)', (uri, provider, encoded, time.time() + ttl)
+            )
+
+    def forget(self, uri, provider):
+        """Drop a result that turned out not to be downloadable."""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM results WHERE uri = ? AND provider = ?',
+                              (uri, provider))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
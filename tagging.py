@@ -0,0 +1,169 @@
+"""Reading and writing song tags for each audio format the library holds.
+
+mp3 files get ID3 frames, FLAC files Vorbis comments and m4a files MP4
+atoms. The Spotify URI is stored as the publisher: the TPUB frame in ID3,
+a PUBLISHER comment in FLAC and a ----:com.apple.iTunes:PUBLISHER atom in
+m4a. Tags are written with mutagen, which edits the tag in place and only
+rewrites the file when the new tag doesn't fit in the existing padding.
+Without mutagen installed only mp3 files can be tagged, through eyed3.
+"""
+
+import importlib.util
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+# mutagen and eyed3 are imported when a file is first tagged or read
+HAVE_MUTAGEN = importlib.util.find_spec('mutagen') is not None
+
+# Extensions that can carry a URI tag
+TAGGED_EXTENSIONS = ('.mp3', '.flac', '.m4a')
+
+MP4_URI_KEY = '----:com.apple.iTunes:PUBLISHER'
+
+
+@dataclass
+class SongTags:
+    """The metadata written to a song's file."""
+    title: str
+    artist: str
+    album: str
+    uri: str
+    art: Optional[bytes] = None
+    # Set once a transcode has written these tags, art included, into the file
+    written: bool = False
+
+
+def art_mime_type(data):
+    """Guess the mime type of a cover from its first bytes"""
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    return 'image/jpeg'
+
+
+def _extension(file_path):
+    return os.path.splitext(file_path)[1].lower()
+
+
+def write_tags(file_path, tags):
+    """Write tags into file_path. Returns False for formats that can't be tagged."""
+    ext = _extension(file_path)
+    if not HAVE_MUTAGEN:
+        if ext != '.mp3':
+            return False
+        return _write_eyed3(file_path, tags)
+    if ext == '.mp3':
+        _write_id3(file_path, tags)
+    elif ext == '.flac':
+        _write_flac(file_path, tags)
+    elif ext == '.m4a':
+        _write_mp4(file_path, tags)
+    else:
+        return False
+    return True
+
+
+def _write_id3(file_path, tags):
+    from mutagen.id3 import ID3, ID3NoHeaderError, APIC, TALB, TIT2, TPE1, TPUB
+
+    try:
+        id3 = ID3(file_path)
+    except ID3NoHeaderError:
+        id3 = ID3()
+    id3.setall('TIT2', [TIT2(encoding=3, text=tags.title)])
+    id3.setall('TPE1', [TPE1(encoding=3, text=tags.artist)])
+    id3.setall('TALB', [TALB(encoding=3, text=tags.album)])
+    id3.setall('TPUB', [TPUB(encoding=3, text=tags.uri)])
+    if tags.art:
+        id3.setall('APIC', [APIC(encoding=3, mime=art_mime_type(tags.art), type=3,
+                                 desc='', data=tags.art)])
+    id3.save(file_path)
+
+
+def _write_flac(file_path, tags):
+    from mutagen.flac import FLAC, Picture
+
+    flac = FLAC(file_path)
+    flac['TITLE'] = tags.title
+    flac['ARTIST'] = tags.artist
+    flac['ALBUM'] = tags.album
+    flac['PUBLISHER'] = tags.uri
+    if tags.art:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = art_mime_type(tags.art)
+        picture.data = tags.art
+        flac.clear_pictures()
+        flac.add_picture(picture)
+    flac.save()
+
+
+def _write_mp4(file_path, tags):
+    from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+
+    mp4 = MP4(file_path)
+    mp4['\xa9nam'] = [tags.title]
+    mp4['\xa9ART'] = [tags.artist]
+    mp4['\xa9alb'] = [tags.album]
+    mp4[MP4_URI_KEY] = [MP4FreeForm(tags.uri.encode('utf-8'))]
+    if tags.art:
+        image_format = (MP4Cover.FORMAT_PNG if art_mime_type(tags.art) == 'image/png'
+                        else MP4Cover.FORMAT_JPEG)
+        mp4['covr'] = [MP4Cover(tags.art, imageformat=image_format)]
+    mp4.save()
+
+
+def _write_eyed3(file_path, tags):
+    import eyed3
+
+    audiofile = eyed3.load(file_path)
+    if audiofile is None:
+        return False
+    if audiofile.tag is None:
+        audiofile.initTag()
+    audiofile.tag.artist = tags.artist
+    audiofile.tag.album = tags.album
+    audiofile.tag.title = tags.title
+    audiofile.tag.publisher = tags.uri
+    if tags.art:
+        audiofile.tag.images.set(3, tags.art, art_mime_type(tags.art))
+    audiofile.tag.save(file_path)
+    return True
+
+
+def read_uri(file_path):
+    """Return the URI stored in a file's tags, or None."""
+    ext = _extension(file_path)
+    if not HAVE_MUTAGEN:
+        if ext != '.mp3':
+            return None
+        import eyed3
+        audiofile = eyed3.load(file_path)
+        if audiofile is None or audiofile.tag is None:
+            return None
+        return audiofile.tag.publisher
+    if ext == '.mp3':
+        from mutagen.id3 import ID3, ID3NoHeaderError
+        try:
+            frame = ID3(file_path).get('TPUB')
+        except ID3NoHeaderError:
+            return None
+        return str(frame.text[0]) if frame and frame.text else None
+    if ext == '.flac':
+        from mutagen.flac import FLAC
+        values = (FLAC(file_path).tags or {}).get('PUBLISHER')
+        return values[0] if values else None
+    if ext == '.m4a':
+        from mutagen.mp4 import MP4
+        values = (MP4(file_path).tags or {}).get(MP4_URI_KEY)
+        return bytes(values[0]).decode('utf-8') if values else None
+    return None
+
+
+def ffmpeg_metadata_args(tags):
+    """Return ffmpeg arguments that write tags' text fields into the output."""
+    args = []
+    for key, value in (('title', tags.title), ('artist', tags.artist),
+                       ('album', tags.album), ('publisher', tags.uri)):
+        args += ['-metadata', f'{key}={value}']
+    return args
@@ -0,0 +1,315 @@
+"""Tests for download_file() against a local HTTP server."""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+import downloader_functions
+from downloader_functions import DownloadError, download_file, find_download
+
+
+class FileServer:
+    """Serves in-memory files on localhost, honouring Range and If-Range.
+
+    Every request's path and headers are recorded in requests. drop[path],
+    or drop[(path, range header)], makes the next matching response stop
+    after that many bytes of body, as if the connection had dropped.
+    """
+
+    def __init__(self):
+        self.files = {}  # path -> (data, etag, extra headers)
+        self.requests = []
+        self.drop = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests.append((self.path, dict(self.headers)))
+                    drop = server.drop.pop((self.path, self.headers.get('Range')), None)
+                    if drop is None:
+                        drop = server.drop.pop(self.path, None)
+                data, etag, extra = server.files[self.path]
+                status, body = 200, data
+                headers = {'Accept-Ranges': 'bytes'}
+                match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if_range = self.headers.get('If-Range')
+                if match and (if_range is None or if_range == etag):
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else len(data) - 1
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(data)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    end = min(end, len(data) - 1)
+                    status, body = 206, data[start:end + 1]
+                    headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+                else:
+                    headers.update(extra)
+                if etag:
+                    headers['ETag'] = etag
+                headers['Content-Length'] = str(len(body))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if drop is not None:
+                    body = body[:drop]
+                    self.close_connection = True
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def add(self, path, data, etag=None, **extra):
+        self.files[path] = (data, etag, extra)
+        return self.url + path
+
+    def requests_for(self, path):
+        return [headers for request_path, headers in self.requests if request_path == path]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class DownloadTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FileServer()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '1 - Song.mp3')
+        self.server.requests.clear()
+        # Don't wait between retries
+        sleep = mock.patch('downloader_functions.time.sleep')
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, path=None):
+        with open(path or self.path, 'rb') as f:
+            return f.read()
+
+    def leave_part(self, data, source=None):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(data)
+        if source is not None:
+            with open(self.path + '.part.source', 'w') as f:
+                json.dump(source, f)
+
+    def assertOnlyFile(self):
+        self.assertEqual(os.listdir(self.dir), [os.path.basename(self.path)])
+
+
+class DownloadFileTest(DownloadTestCase):
+    def test_downloads_whole_file(self):
+        data = os.urandom(5000)
+        url = self.server.add('/whole', data, etag='"w"')
+        self.assertEqual(download_file(url, self.path, chunk_size=1024), self.path)
+        self.assertEqual(self.read(), data)
+        self.assertOnlyFile()
+
+    def test_resumes_dropped_connection_with_if_range(self):
+        data = os.urandom(5000)
+        url = self.server.add('/drop', data, etag='"d"')
+        self.server.drop['/drop'] = 2000
+        download_file(url, self.path, chunk_size=500)
+        self.assertEqual(self.read(), data)
+        retry = self.server.requests_for('/drop')[1]
+        self.assertEqual(retry['Range'], 'bytes=2000-')
+        self.assertEqual(retry['If-Range'], '"d"')
+        self.assertOnlyFile()
+
+    def test_resumes_part_left_by_earlier_run(self):
+        data = os.urandom(5000)
+        url = self.server.add('/earlier', data, etag='"e"')
+        # Signed urls change between runs, the ETag still matches
+        self.leave_part(data[:3000], {'url': 'https://old/signed', 'etag': '"e"',
+                                      'last_modified': None})
+        download_file(url, self.path)
+        self.assertEqual(self.read(), data)
+        self.assertEqual(self.server.requests_for('/earlier')[0]['Range'], 'bytes=3000-')
+
+    def test_part_from_other_source_is_not_appended_to(self):
+        qobuz = os.urandom(4000)
+        jamendo = os.urandom(6000)
+        self.server.add('/qobuz', qobuz, etag='"q"')
+        url = self.server.add('/jamendo', jamendo, etag='"j"')
+        self.leave_part(qobuz[:1500], {'url': self.server.url + '/qobuz', 'etag': '"q"',
+                                       'last_modified': None})
+        download_file(url, self.path)
+        self.assertEqual(self.read(), jamendo)
+        self.assertOnlyFile()
+
+    def test_part_without_source_is_discarded(self):
+        data = os.urandom(3000)
+        url = self.server.add('/nosource', data)
+        self.leave_part(os.urandom(1000))
+        download_file(url, self.path)
+        self.assertEqual(self.read(), data)
+        self.assertNotIn('Range', self.server.requests_for('/nosource')[0])
+
+    def test_part_without_validator_resumes_only_same_url(self):
+        data = os.urandom(3000)
+        url = self.server.add('/plain', data)
+        self.leave_part(data[:1000], {'url': url, 'etag': None, 'last_modified': None})
+        download_file(url, self.path)
+        self.assertEqual(self.read(), data)
+        self.assertEqual(self.server.requests_for('/plain')[0]['Range'], 'bytes=1000-')
+
+        os.remove(self.path)
+        self.leave_part(os.urandom(1000), {'url': url + '?other', 'etag': None,
+                                           'last_modified': None})
+        download_file(url, self.path)
+        self.assertEqual(self.read(), data)
+
+    def test_complete_part_starts_over_on_416(self):
+        data = os.urandom(2000)
+        url = self.server.add('/done', data, etag='"x"')
+        self.leave_part(data + b'extra', {'url': url, 'etag': '"x"', 'last_modified': None})
+        download_file(url, self.path)
+        self.assertEqual(self.read(), data)
+
+    def test_checksum(self):
+        data = os.urandom(3000)
+        digest = base64.b64encode(hashlib.sha256(data).digest()).decode()
+        url = self.server.add('/digest', data, Digest=f'sha-256={digest}')
+        download_file(url, self.path)
+        self.assertEqual(self.read(), data)
+
+        os.remove(self.path)
+        wrong = base64.b64encode(hashlib.sha256(data[1:]).digest()).decode()
+        url = self.server.add('/baddigest', data, Digest=f'sha-256={wrong}')
+        with self.assertRaises(DownloadError):
+            download_file(url, self.path)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_content_md5_checked_on_resumed_download(self):
+        data = os.urandom(3000)
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        url = self.server.add('/md5', data, etag='"m"', **{'Content-MD5': md5})
+        self.server.drop['/md5'] = 1000
+        download_file(url, self.path)
+        self.assertEqual(self.read(), data)
+
+    def test_gives_up_after_attempts(self):
+        data = os.urandom(3000)
+        url = self.server.add('/flaky', data, etag='"f"')
+        real_get = downloader_functions.http_get
+
+        def dropping_get(url, **kwargs):
+            self.server.drop['/flaky'] = 100
+            return real_get(url, **kwargs)
+
+        with mock.patch('downloader_functions.http_get', dropping_get):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                download_file(url, self.path, attempts=3)
+        self.assertEqual(len(self.server.requests_for('/flaky')), 3)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class SegmentedDownloadTest(DownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        threshold = mock.patch('downloader_functions.SEGMENT_THRESHOLD', 4096)
+        threshold.start()
+        self.addCleanup(threshold.stop)
+
+    def test_fetches_segments(self):
+        data = os.urandom(20000)
+        url = self.server.add('/segments', data, etag='"s"')
+        download_file(url, self.path, segments=4, chunk_size=1000)
+        self.assertEqual(self.read(), data)
+        ranges = sorted(headers['Range'] for headers in self.server.requests_for('/segments')
+                        if 'Range' in headers)
+        self.assertEqual(ranges, ['bytes=0-4999', 'bytes=10000-14999',
+                                  'bytes=15000-19999', 'bytes=5000-9999'])
+        self.assertOnlyFile()
+
+    def test_resumes_dropped_segment(self):
+        data = os.urandom(20000)
+        url = self.server.add('/segdrop', data, etag='"sd"')
+        self.server.drop[('/segdrop', 'bytes=5000-9999')] = 1200
+        download_file(url, self.path, segments=4, chunk_size=400)
+        self.assertEqual(self.read(), data)
+        ranges = [headers.get('Range') for headers in self.server.requests_for('/segdrop')]
+        self.assertIn('bytes=6200-9999', ranges)
+
+    def test_failed_segment_discards_part(self):
+        data = os.urandom(20000)
+        url = self.server.add('/segfail', data, etag='"sf"')
+        real_get = downloader_functions.http_get
+
+        def dropping_get(url, **kwargs):
+            range_header = (kwargs.get('headers') or {}).get('Range', '')
+            if range_header.startswith('bytes=5000-'):
+                self.server.drop['/segfail', range_header] = 10
+            return real_get(url, **kwargs)
+
+        with mock.patch('downloader_functions.http_get', dropping_get):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                download_file(url, self.path, segments=4, attempts=2)
+        # A preallocated .part can't be resumed from its size
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_small_file_uses_one_connection(self):
+        data = os.urandom(3000)
+        url = self.server.add('/small', data, etag='"sm"')
+        download_file(url, self.path, segments=4)
+        self.assertEqual(self.read(), data)
+        self.assertEqual(len(self.server.requests_for('/small')), 1)
+
+
+class FindDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def touch(self, name, mtime=None):
+        path = os.path.join(self.dir, name)
+        open(path, 'wb').close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_ignores_partial_and_temporary_files(self):
+        for name in ('1 - Foo.mp3.part', '1 - Foo.mp3.part.source', '1 - Foo.converting.mp3',
+                     '1 - Foo.cover', '1 - Foobar.mp3', '1 - Foo.webm.ytdl'):
+            self.touch(name)
+        self.assertIsNone(find_download(self.dir, '1 - Foo'))
+        path = self.touch('1 - Foo.webm')
+        self.assertEqual(find_download(self.dir, '1 - Foo'), path)
+
+    def test_prefers_newest(self):
+        self.touch('1 - Foo.mp3', mtime=1000)
+        path = self.touch('1 - Foo.opus', mtime=2000)
+        self.assertEqual(find_download(self.dir, '1 - Foo'), path)
+
+
+if __name__ == '__main__':
+    unittest.main()
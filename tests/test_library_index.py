@@ -0,0 +1,204 @@
+"""Tests for the library index and the fast tag readers used to build it."""
+
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from library_index import (UNKNOWN, LibraryIndex, read_mp4_publisher, read_publisher,
+                           read_tag_uri, read_vorbis_publisher)
+
+URI = 'spotify:track:4uLU6hMCjMI75M1A2tKUQC'
+
+
+def syncsafe(n):
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f])
+
+
+def id3_frame(frame_id, text, version=3, flags=0, encoding=3):
+    codec = {0: 'latin-1', 1: 'utf-16', 3: 'utf-8'}[encoding]
+    data = bytes([encoding]) + text.encode(codec)
+    if version == 2:
+        return frame_id + len(data).to_bytes(3, 'big') + data
+    size = struct.pack('>I', len(data)) if version == 3 else syncsafe(len(data))
+    return frame_id + size + struct.pack('>H', flags) + data
+
+
+def id3_tag(frames, version=3, flags=0, extended=b''):
+    body = extended + b''.join(frames) + b'\x00' * 16  # padding
+    return b'ID3' + bytes([version, 0, flags]) + syncsafe(len(body)) + body + b'\xff\xfb' * 64
+
+
+def flac_block(block_type, body, last=False):
+    return bytes([block_type | (0x80 if last else 0)]) + len(body).to_bytes(3, 'big') + body
+
+
+def vorbis_comments(*comments):
+    vendor = b'reference libFLAC 1.4.3'
+    body = struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', len(comments))
+    for comment in comments:
+        data = comment.encode('utf-8')
+        body += struct.pack('<I', len(data)) + data
+    return body
+
+
+def atom(kind, *children):
+    body = b''.join(children)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def freeform(name, value):
+    return atom(b'----',
+                atom(b'mean', b'\x00' * 4, b'com.apple.iTunes'),
+                atom(b'name', b'\x00' * 4, name.encode()),
+                atom(b'data', b'\x00\x00\x00\x01', b'\x00' * 4, value.encode()))
+
+
+def mp4(ilst, audio_first=False):
+    moov = atom(b'moov',
+                atom(b'mvhd', b'\x00' * 100),
+                atom(b'udta', atom(b'meta', b'\x00' * 4,
+                                   atom(b'hdlr', b'\x00' * 25),
+                                   atom(b'ilst', *ilst))))
+    mdat = atom(b'mdat', b'\x00' * 512)
+    ftyp = atom(b'ftyp', b'M4A \x00\x00\x02\x00M4A isom')
+    return ftyp + (mdat + moov if audio_first else moov + mdat)
+
+
+class ReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+class ReadPublisherTest(ReaderTestCase):
+    def test_id3v23(self):
+        path = self.write('a.mp3', id3_tag([id3_frame(b'TIT2', 'Title'),
+                                            id3_frame(b'TPUB', URI)]))
+        self.assertEqual(read_publisher(path), URI)
+
+    def test_id3v24(self):
+        # Large enough that a plain size would differ from the syncsafe one
+        path = self.write('a.mp3', id3_tag([id3_frame(b'COMM', 'x' * 200, version=4),
+                                            id3_frame(b'TPUB', URI, version=4)], version=4))
+        self.assertEqual(read_publisher(path), URI)
+
+    def test_id3v22(self):
+        path = self.write('a.mp3', id3_tag([id3_frame(b'TT2', 'Title', version=2),
+                                            id3_frame(b'TPB', URI, version=2)], version=2))
+        self.assertEqual(read_publisher(path), URI)
+
+    def test_utf16_text(self):
+        path = self.write('a.mp3', id3_tag([id3_frame(b'TPUB', URI, encoding=1)]))
+        self.assertEqual(read_publisher(path), URI)
+
+    def test_extended_header_is_skipped(self):
+        v3 = id3_tag([id3_frame(b'TPUB', URI)], flags=0x40,
+                     extended=struct.pack('>I', 6) + b'\x00' * 6)
+        v4 = id3_tag([id3_frame(b'TPUB', URI, version=4)], version=4, flags=0x40,
+                     extended=syncsafe(6) + b'\x01\x00')
+        self.assertEqual(read_publisher(self.write('v3.mp3', v3)), URI)
+        self.assertEqual(read_publisher(self.write('v4.mp3', v4)), URI)
+
+    def test_compressed_or_encrypted_frames_are_unknown(self):
+        v3 = id3_tag([id3_frame(b'TPUB', URI, flags=0x0080)])
+        v4 = id3_tag([id3_frame(b'TPUB', URI, version=4, flags=0x0004)], version=4)
+        self.assertIs(read_publisher(self.write('v3.mp3', v3)), UNKNOWN)
+        self.assertIs(read_publisher(self.write('v4.mp3', v4)), UNKNOWN)
+
+    def test_flags_on_other_frames_are_ignored(self):
+        path = self.write('a.mp3', id3_tag([id3_frame(b'APIC', 'x' * 40, flags=0x0080),
+                                            id3_frame(b'TPUB', URI)]))
+        self.assertEqual(read_publisher(path), URI)
+
+    def test_unsynchronised_tag_is_unknown(self):
+        path = self.write('a.mp3', id3_tag([id3_frame(b'TPUB', URI)], flags=0x80))
+        self.assertIs(read_publisher(path), UNKNOWN)
+
+    def test_missing_tag_or_frame(self):
+        self.assertIsNone(read_publisher(self.write('a.mp3', b'\xff\xfb' * 64)))
+        self.assertIsNone(read_publisher(self.write('b.mp3', id3_tag([id3_frame(b'TIT2', 'T')]))))
+
+
+class ReadVorbisPublisherTest(ReaderTestCase):
+    def test_comment_after_picture(self):
+        path = self.write('a.flac', b'fLaC'
+                          + flac_block(0, b'\x00' * 34)
+                          + flac_block(6, b'\x00' * 5000)
+                          + flac_block(4, vorbis_comments('TITLE=Title', f'publisher={URI}'),
+                                       last=True))
+        self.assertEqual(read_vorbis_publisher(path), URI)
+
+    def test_no_comments(self):
+        path = self.write('a.flac', b'fLaC' + flac_block(0, b'\x00' * 34, last=True))
+        self.assertIsNone(read_vorbis_publisher(path))
+        path = self.write('b.flac', b'fLaC' + flac_block(4, vorbis_comments('TITLE=T'), last=True))
+        self.assertIsNone(read_vorbis_publisher(path))
+
+    def test_id3_in_front_is_unknown(self):
+        path = self.write('a.flac', id3_tag([id3_frame(b'TPUB', URI)]))
+        self.assertIs(read_vorbis_publisher(path), UNKNOWN)
+
+
+class ReadMp4PublisherTest(ReaderTestCase):
+    def test_freeform_publisher(self):
+        ilst = [atom(b'\xa9nam', atom(b'data', b'\x00\x00\x00\x01', b'\x00' * 4, b'Title')),
+                freeform('iTunNORM', 'ignored'),
+                freeform('PUBLISHER', URI)]
+        self.assertEqual(read_mp4_publisher(self.write('a.m4a', mp4(ilst))), URI)
+        self.assertEqual(read_mp4_publisher(self.write('b.m4a', mp4(ilst, audio_first=True))), URI)
+
+    def test_no_publisher(self):
+        path = self.write('a.m4a', mp4([freeform('iTunNORM', 'ignored')]))
+        self.assertIsNone(read_mp4_publisher(path))
+        path = self.write('b.m4a', atom(b'ftyp', b'M4A ') + atom(b'mdat', b'\x00' * 64))
+        self.assertIsNone(read_mp4_publisher(path))
+
+
+class ReadTagUriTest(ReaderTestCase):
+    def test_picks_reader_by_extension(self):
+        path = self.write('a.MP3', id3_tag([id3_frame(b'TPUB', URI)]))
+        self.assertEqual(read_tag_uri(path), URI)
+        self.assertIsNone(read_tag_uri(self.write('a.wav', b'RIFF')))
+
+    def test_truncated_tag_is_unknown(self):
+        data = b'fLaC' + flac_block(4, vorbis_comments(f'PUBLISHER={URI}'), last=True)
+        path = self.write('a.flac', data[:20])
+        self.assertIs(read_tag_uri(path), UNKNOWN)
+
+
+class LibraryIndexTest(ReaderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = LibraryIndex(os.path.join(self.folder, 'index.db'))
+        self.addCleanup(self.library.close)
+        self.root = os.path.join(self.folder, 'Playlist')
+        os.makedirs(self.root)
+
+    def test_added_files_are_not_read_again(self):
+        old = self.write('Playlist/old.mp3', id3_tag([id3_frame(b'TPUB', URI)]))
+        self.library.refresh([self.root], quiet=True)
+        self.assertEqual(self.library.paths(URI), [old])
+
+        new = self.write('Playlist/new.mp3', id3_tag([id3_frame(b'TPUB', 'spotify:track:new')]))
+        self.library.add(new, 'spotify:track:new')
+        self.assertEqual(self.library.uris(self.root), {URI, 'spotify:track:new'})
+        with mock.patch('library_index.readUri') as read:
+            self.library.refresh([self.root], quiet=True)
+        read.assert_not_called()
+
+        self.library.remove(old)
+        os.remove(old)
+        self.assertEqual(self.library.uris(self.root), {'spotify:track:new'})
+
+
+if __name__ == '__main__':
+    unittest.main()
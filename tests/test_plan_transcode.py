@@ -0,0 +1,91 @@
+"""Tests for the conversion chosen by plan_transcode() and run by adjust_audio_format()."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from downloader_functions import adjust_audio_format, plan_transcode
+from tagging import SongTags
+
+
+def info(codec):
+    return {'codec_name': codec, 'bit_rate': 128000, 'format_name': ''}
+
+
+class PlanTranscodeTest(unittest.TestCase):
+    def test_files_in_library_format_are_kept(self):
+        self.assertIsNone(plan_transcode('a.mp3', info('mp3')))
+        self.assertIsNone(plan_transcode('a.flac', info('flac')))
+
+    def test_wrong_container_is_copied(self):
+        self.assertEqual(plan_transcode('a.webm', info('mp3')), ('.mp3', ['-c:a', 'copy']))
+        self.assertEqual(plan_transcode('a.ogg', info('flac')), ('.flac', ['-c:a', 'copy']))
+
+    def test_lossless_becomes_flac(self):
+        for codec in ('alac', 'wavpack', 'pcm_s16le', 'pcm_s24le'):
+            self.assertEqual(plan_transcode('a.m4a', info(codec)), ('.flac', ['-c:a', 'flac']),
+                             codec)
+
+    def test_other_lossy_codecs_become_mp3(self):
+        for codec in ('opus', 'vorbis'):
+            ext, args = plan_transcode('a.webm', info(codec))
+            self.assertEqual(ext, '.mp3')
+            self.assertIn('libmp3lame', args)
+
+    def test_unknown_contents(self):
+        self.assertIsNone(plan_transcode('a.mp3', None))
+        self.assertEqual(plan_transcode('a.webm', None)[0], '.mp3')
+        self.assertEqual(plan_transcode('a.webm', info(None))[0], '.mp3')
+
+    @mock.patch('downloader_functions.HAVE_MUTAGEN', True)
+    def test_aac_is_kept_as_m4a(self):
+        self.assertIsNone(plan_transcode('a.m4a', info('aac')))
+        self.assertEqual(plan_transcode('a.mp4', info('aac')), ('.m4a', ['-c:a', 'copy']))
+        self.assertEqual(plan_transcode('a.aac', info('aac')), ('.m4a', ['-c:a', 'copy']))
+
+    @mock.patch('downloader_functions.HAVE_MUTAGEN', False)
+    def test_aac_becomes_mp3_when_m4a_cant_be_tagged(self):
+        ext, args = plan_transcode('a.m4a', info('aac'))
+        self.assertEqual(ext, '.mp3')
+        self.assertIn('libmp3lame', args)
+
+
+def fake_ffmpeg(source, target, codec_args, tags=None, cover_path=None):
+    with open(target, 'wb') as f:
+        f.write(b'converted')
+    return True
+
+
+@mock.patch('downloader_functions.probe_audio', lambda path: None)
+@mock.patch('downloader_functions._run_ffmpeg', fake_ffmpeg)
+class AdjustAudioFormatTest(unittest.TestCase):
+    def convert(self, name, plan):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, name)
+        with open(path, 'wb') as f:
+            f.write(b'source')
+        tags = SongTags('Title', 'Artist', 'Album', 'spotify:track:1', art=b'cover')
+        with mock.patch('downloader_functions.plan_transcode', lambda path, info: plan):
+            new_path = adjust_audio_format(path, quiet=True, tags=tags)
+        self.assertTrue(os.path.exists(new_path))
+        self.assertEqual(sorted(os.listdir(folder.name)), [os.path.basename(new_path)])
+        return new_path, tags
+
+    def test_tags_written_by_ffmpeg_for_mp3_and_flac(self):
+        for name, plan in (('a.webm', ('.mp3', ['-c:a', 'copy'])),
+                           ('a.wav', ('.flac', ['-c:a', 'flac']))):
+            new_path, tags = self.convert(name, plan)
+            self.assertEqual(os.path.splitext(new_path)[1], plan[0])
+            self.assertTrue(tags.written, name)
+
+    def test_m4a_is_still_tagged_afterwards(self):
+        # ffmpeg doesn't write the publisher tag holding the URI to m4a
+        new_path, tags = self.convert('a.mp4', ('.m4a', ['-c:a', 'copy']))
+        self.assertTrue(new_path.endswith('.m4a'))
+        self.assertFalse(tags.written)
+
+
+if __name__ == '__main__':
+    unittest.main()
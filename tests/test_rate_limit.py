@@ -0,0 +1,219 @@
+"""Tests for the rate limiters and call_limited()."""
+
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import downloader_functions
+from downloader_functions import DownloadProvider, call_limited, provider_limiter
+from rate_limit import AdaptiveLimiter, ProviderLimiter, Throttled, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.1)
+        for _ in range(4):
+            bucket.acquire()
+        # Four more tokens at 20 a second
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_rejects_non_positive_rate(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def test_starts_at_half_of_maximum(self):
+        self.assertEqual(AdaptiveLimiter(maximum=8).limit, 4)
+        self.assertEqual(AdaptiveLimiter(maximum=1).limit, 1)
+
+    def test_additive_increase(self):
+        limiter = AdaptiveLimiter(maximum=8)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        # One round of four successes adds about one
+        self.assertAlmostEqual(limiter.limit, 5, delta=0.2)
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release()
+        self.assertEqual(limiter.limit, 8)
+
+    def test_multiplicative_decrease_once_per_cooldown(self):
+        limiter = AdaptiveLimiter(maximum=16, cooldown=60)
+        limiter.acquire()
+        limiter.release(throttled=True, succeeded=False)
+        self.assertEqual(limiter.limit, 4)
+        # Requests already in flight when throttling started don't count again
+        limiter.acquire()
+        limiter.release(throttled=True, succeeded=False)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_decrease_stops_at_minimum(self):
+        limiter = AdaptiveLimiter(maximum=8, minimum=2, cooldown=0)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(throttled=True, succeeded=False)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_failures_leave_limit_alone(self):
+        limiter = AdaptiveLimiter(maximum=8)
+        limiter.acquire()
+        limiter.release(throttled=False, succeeded=False)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_acquire_waits_for_a_free_slot(self):
+        limiter = AdaptiveLimiter(maximum=2)  # limit 1
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def second():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=second, daemon=True)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release()
+        self.assertTrue(acquired.wait(1))
+        thread.join(1)
+
+
+class CallLimitedTest(unittest.TestCase):
+    def setUp(self):
+        self.provider = DownloadProvider(name=f'Test {self.id()}', url_resolver=lambda query: None,
+                                         max_concurrency=8, throttle_retries=3)
+        self.limiter = provider_limiter(self.provider, 'search').concurrency
+        sleep = mock.patch('downloader_functions.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def test_returns_result(self):
+        self.assertEqual(call_limited(self.provider, 'search', lambda x: x * 2, 21), 42)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_retries_throttled_calls_with_backoff(self):
+        calls = []
+
+        def flaky():
+            calls.append(None)
+            if len(calls) < 3:
+                raise Throttled("slow down", retry_after=5)
+            return 'ok'
+
+        self.assertEqual(call_limited(self.provider, 'search', flaky), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([c.args[0] for c in self.sleep.call_args_list], [5, 5])
+        self.assertEqual(self.limiter.in_flight, 0)
+        # Halved from 4 once, then one success
+        self.assertEqual(self.limiter.limit, 2.5)
+
+    def test_gives_up_after_throttle_retries(self):
+        def throttled():
+            raise Throttled("slow down")
+
+        with self.assertRaises(Throttled):
+            call_limited(self.provider, 'search', throttled)
+        self.assertEqual(self.sleep.call_count, 3)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_long_retry_after_is_not_waited_for(self):
+        def throttled():
+            raise Throttled("come back tomorrow",
+                            retry_after=downloader_functions.MAX_THROTTLE_WAIT + 1)
+
+        with self.assertRaises(Throttled):
+            call_limited(self.provider, 'search', throttled)
+        self.sleep.assert_not_called()
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        def broken():
+            calls.append(None)
+            raise KeyError('missing')
+
+        with self.assertRaises(KeyError):
+            call_limited(self.provider, 'search', broken)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_slot_released_when_classifying_the_error_fails(self):
+        def broken():
+            raise ValueError('boom')
+
+        with mock.patch('downloader_functions._throttle_delay', side_effect=AttributeError):
+            for _ in range(3):
+                with self.assertRaises(AttributeError):
+                    call_limited(self.provider, 'search', broken)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_limiters_are_shared_by_name(self):
+        self.assertIs(provider_limiter(self.provider, 'search'),
+                      provider_limiter(self.provider, 'search'))
+        self.assertIsNot(provider_limiter(self.provider, 'search'),
+                         provider_limiter(self.provider, 'download'))
+
+
+class FakeSearchEngine:
+    """Answers each search with the next result, raising it if it's an exception."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.queries = []
+
+    def search(self, query, count=15):
+        self.queries.append(query)
+        future = Future()
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+        return future
+
+
+class YouTubeSearchTest(unittest.TestCase):
+    def setUp(self):
+        provider = DownloadProvider(name=f'Test {self.id()}', url_resolver=lambda query: None,
+                                    max_concurrency=8)
+        for patch in (mock.patch('downloader_functions.time.sleep'),
+                      mock.patch('downloader_functions.YOUTUBE_LIMITS', provider)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.limiter = provider_limiter(provider, 'search').concurrency
+
+    def search(self, *results):
+        engine = FakeSearchEngine(*results)
+        with mock.patch('downloader_functions._youtube_search_engine', engine):
+            return downloader_functions._youtube_search('song artist'), engine
+
+    def test_429_is_retried(self):
+        videos = [{'url': 'u', 'duration': 1, 'title': 't'}]
+        result, engine = self.search(Exception("ERROR: HTTP Error 429: Too Many Requests"), videos)
+        self.assertEqual(result, videos)
+        self.assertEqual(engine.queries, ['song artist'] * 2)
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertLess(self.limiter.limit, 4)
+
+    def test_other_errors_are_not_retried(self):
+        with self.assertRaisesRegex(Exception, "No videos found"):
+            self.search(Exception("No videos found"))
+        self.assertEqual(self.limiter.in_flight, 0)
+
+
+class ProviderLimiterTest(unittest.TestCase):
+    def test_without_rate_limit_only_concurrency_is_limited(self):
+        limiter = ProviderLimiter(max_concurrency=4)
+        self.assertIsNone(limiter.bucket)
+        self.assertEqual(limiter.concurrency.maximum, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()